@@ -0,0 +1,179 @@
+"""
+Archivado del historial de movimientos antiguo.
+Cada mes anterior a MOVEMENTS_ARCHIVE_AFTER_MONTHS se escribe en un fichero NDJSON comprimido con gzip
+(MOVEMENTS_ARCHIVE_DIR/stock_movements_AAAA_MM.ndjson.gz), se guarda un resumen por producto en movement_summaries
+y se elimina de stock_movements (en PostgreSQL particionado, soltando la partición del mes). El stock actual y el
+historial reciente no pasan por los meses archivados; la exportación de movimientos sigue leyéndolos de los ficheros
+y el stock histórico de esos meses sale de los snapshots diarios (con resolución de día, ver snapshots.stock_at).
+
+    python -m app.archive                      # archiva los meses anteriores a MOVEMENTS_ARCHIVE_AFTER_MONTHS
+    python -m app.archive --before 2024-01-01  # archiva los meses que terminan antes de esa fecha
+"""
+
+import argparse
+import gzip
+import json
+import os
+from datetime import date, datetime
+from typing import Iterator
+
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .export import MOVEMENT_FIELDS, movements_query, stream_rows
+from .models import MovementArchive, MovementSummary, SnapshotState, StockMovement
+from .partitions import add_months, drop_partition, is_partitioned, month_start, partition_name
+from .reports import metrics_query
+from .snapshots import discard_from_window
+
+MOVEMENTS_ARCHIVE_DIR = os.getenv("MOVEMENTS_ARCHIVE_DIR", "archive")  # Carpeta de los ficheros archivados
+MOVEMENTS_ARCHIVE_AFTER_MONTHS = int(os.getenv("MOVEMENTS_ARCHIVE_AFTER_MONTHS", "12"))  # Meses que se mantienen en la tabla
+
+PRODUCT_ID, CREATED_AT = MOVEMENT_FIELDS.index("product_id"), MOVEMENT_FIELDS.index("created_at")
+
+def _day(month: date) -> datetime:
+    return datetime(month.year, month.month, 1)
+
+def _encode(row) -> str:
+    values = dict(zip(MOVEMENT_FIELDS, row))
+    values["created_at"] = values["created_at"].isoformat()
+    return json.dumps(values, ensure_ascii=False)
+
+def write_archive(db: Session, start: datetime, end: datetime, path: str) -> int:
+    """
+    Escribe los movimientos de [start, end) en orden cronológico en un NDJSON con gzip.
+    Se escribe en un fichero temporal que se renombra al terminar: nunca queda un archivo a medias.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    rows = 0
+    with open(tmp, "wb") as raw:
+        with gzip.open(raw, "wt", encoding="utf-8") as f:
+            for row in stream_rows(db, movements_query(since=start, until=end)):
+                f.write(_encode(row) + "\n")
+                rows += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return rows
+
+def _rolled_up(db: Session, start: datetime, end: datetime) -> bool:
+    # Solo se archiva un mes ya agregado en stock_snapshots (el stock histórico sale de ahí)
+    last_id = db.execute(
+        select(func.max(StockMovement.id)).where(StockMovement.created_at >= start, StockMovement.created_at < end)
+    ).scalar()
+    if last_id is None:
+        return True
+    state = db.get(SnapshotState, 1)
+    return state is not None and state.last_movement_id >= last_id
+
+def archive_month(db: Session, month: date, archive_dir: str | None = None) -> MovementArchive | None:
+    """
+    Archiva un mes: fichero, resumen por producto, registro en movement_archives y borrado de la tabla,
+    todo lo que toca la base de datos en una transacción. None si ya estaba archivado o aún no está agregado.
+    """
+    archive_dir = archive_dir or MOVEMENTS_ARCHIVE_DIR
+    start, end = _day(month), _day(add_months(month, 1))
+    if db.execute(select(MovementArchive.id).where(MovementArchive.period_start == start)).first() is not None:
+        return None
+    if not _rolled_up(db, start, end):
+        return None
+
+    name = f"{partition_name(month)}.ndjson.gz"
+    rows = write_archive(db, start, end, os.path.join(archive_dir, name))
+    summary = metrics_query(start, end).subquery()
+    db.execute(insert(MovementSummary).from_select(
+        ["product_id", "period_start", "movements", "qty_in", "qty_out", "opening_qty", "closing_qty"],
+        select(
+            summary.c.product_id, literal(start), summary.c.movements, summary.c.qty_in, summary.c.qty_out,
+            summary.c.opening_qty, summary.c.closing_qty,
+        ),
+    ))
+    archive = MovementArchive(
+        period_start=start, period_end=end, path=name, rows=rows,
+        size_bytes=os.path.getsize(os.path.join(archive_dir, name)),
+    )
+    db.add(archive)
+    discard_from_window(db, start, end)
+    conn = db.connection()
+    if is_partitioned(conn):
+        drop_partition(conn, month)
+    # Sin particiones (o filas del mes en la partición DEFAULT) se borran por rango de fechas
+    db.execute(
+        delete(StockMovement)
+        .where(StockMovement.created_at >= start, StockMovement.created_at < end)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return archive
+
+def archive_before(db: Session, before: datetime, archive_dir: str | None = None) -> list[MovementArchive]:
+    """Archiva todos los meses completos anteriores a before"""
+    first = db.execute(select(func.min(StockMovement.created_at))).scalar()
+    if first is None:
+        return []
+    archived = []
+    month, limit = month_start(first), month_start(before)
+    while month < limit:
+        archive = archive_month(db, month, archive_dir)
+        if archive is not None:
+            archived.append(archive)
+        month = add_months(month, 1)
+    return archived
+
+# ------- Lectura de los archivos -------
+def read_archive(path: str) -> Iterator[tuple]:
+    """Filas de un fichero archivado, en el orden de MOVEMENT_FIELDS"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            values = json.loads(line)
+            values["created_at"] = datetime.fromisoformat(values["created_at"])
+            yield tuple(values[k] for k in MOVEMENT_FIELDS)
+
+def archived_movements(
+    bind: Engine | Connection,
+    product_id: int | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    archive_dir: str | None = None,
+) -> Iterator[tuple]:
+    """
+    Movimientos archivados con los mismos filtros que export.movements_query, en orden cronológico.
+    Solo se abren los ficheros de los meses que se solapan con [since, until).
+    """
+    archive_dir = archive_dir or MOVEMENTS_ARCHIVE_DIR
+    q = select(MovementArchive.path).order_by(MovementArchive.period_start)
+    if since:
+        q = q.where(MovementArchive.period_end > since)
+    if until:
+        q = q.where(MovementArchive.period_start < until)
+    with Session(bind=bind) as db:
+        paths = db.execute(q).scalars().all()
+    for path in paths:
+        for row in read_archive(os.path.join(archive_dir, path)):
+            created_at = row[CREATED_AT]
+            if product_id and row[PRODUCT_ID] != product_id:
+                continue
+            if (since and created_at < since) or (until and created_at >= until):
+                continue
+            yield row
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.archive", description="Archivado de movimientos antiguos")
+    parser.add_argument("--before", type=date.fromisoformat, help="Archivar los meses anteriores a esta fecha (AAAA-MM-DD)")
+    parser.add_argument("--dir", default=MOVEMENTS_ARCHIVE_DIR, help="Carpeta de los ficheros archivados")
+    args = parser.parse_args(argv)
+
+    from .database import SessionLocal
+
+    if args.before:
+        before = datetime(args.before.year, args.before.month, args.before.day)
+    else:
+        before = _day(add_months(month_start(datetime.utcnow()), -MOVEMENTS_ARCHIVE_AFTER_MONTHS))
+    with SessionLocal() as db:
+        for archive in archive_before(db, before, args.dir):
+            print(f"{archive.period_start:%Y-%m}: {archive.rows} movimientos → {archive.path} ({archive.size_bytes} bytes)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Rutas principales del inventario en modo asíncrono (DB_ASYNC=true).
+Mismos paths, parámetros y respuestas que las rutas síncronas de main.py, pero sobre AsyncSession:
+las esperas a la base de datos no ocupan un hilo del threadpool de Starlette.
+"""
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud_async as crud
+from .crud import InsufficientStock
+from .database import get_async_db, get_async_read_db
+from .deps import (
+    FAST_SERIALIZATION, RequireAuth, MovementListParams, ProductListParams, movement_batch, movement_list_params,
+    movements_page, product_list_params, products_page,
+)
+from .idempotency import IdempotencyError, replay_movement
+from .http_cache import conditional, data_version_async
+from .schemas import MovementCreate, MovementOut, ProductCreate, ProductOut, StockAdjust
+
+router = APIRouter(tags=["inventory"])
+
+# ------- Productos -------
+@router.get("/api/products", response_model=list[ProductOut])
+async def api_list_products(
+    request: Request,
+    params: ProductListParams = Depends(product_list_params),
+    db: AsyncSession = Depends(get_async_read_db),
+    _auth=Depends(RequireAuth),
+):
+    # Lista productos paginados por ID con filtros opcionales y proyección de columnas
+    cond = conditional(request, await data_version_async(db))
+    if cond.response is not None:
+        return cond.response
+    return cond.store(*products_page(await crud.list_products(db, **params.filters()), params))
+
+@router.post("/api/products", response_model=ProductOut)
+async def api_create_product(payload: ProductCreate, db: AsyncSession = Depends(get_async_db), _auth=Depends(RequireAuth)):
+    # Crea un nuevo producto con SKU, EAN13, nombre y stock inicial
+    return await crud.create_product(db, sku=payload.sku, ean13=payload.ean13, name=payload.name, stock_qty=payload.stock_qty)
+
+@router.patch("/api/products/{product_id}/stock", response_model=MovementOut)
+async def api_adjust_stock(product_id: int, payload: StockAdjust, db: AsyncSession = Depends(get_async_db), _auth=Depends(RequireAuth)):
+    # Ajusta la cantidad de stock de un producto y registra el movimiento
+    product = await crud.get_product(db, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    try:
+        return await crud.set_stock(db, product, quantity=payload.quantity, reason=payload.reason)
+    except InsufficientStock:
+        raise HTTPException(status_code=409, detail="La cantidad es menor que el stock reservado")
+
+# ------- Movimientos -------
+@router.post("/api/movements", response_model=MovementOut)
+async def api_create_movement(
+    payload: MovementCreate,
+    response: Response,
+    idempotency_key: str | None = Header(None, min_length=1, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
+    _auth=Depends(RequireAuth),
+):
+    # Registra un movimiento de stock (entrada o salida) para un producto (ver Idempotency-Key en main.py)
+    key = idempotency_key or payload.idempotency_key
+    if key:
+        try:
+            original = await db.run_sync(replay_movement, key, payload.product_id, payload.delta, payload.reason)
+        except IdempotencyError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        if original is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return original
+    product = await crud.get_product(db, payload.product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    mtype = "IN" if payload.delta >= 0 else "OUT"
+    try:
+        return await crud.record_movement(
+            db, product, delta=payload.delta, reason=payload.reason, mtype=mtype, idempotency_key=key,
+        )
+    except InsufficientStock:
+        raise HTTPException(status_code=409, detail="Stock disponible insuficiente")
+
+@router.post("/api/movements/bulk", response_model=list[MovementOut])
+async def api_create_movements_bulk(
+    items: list[MovementCreate] = Depends(movement_batch),
+    db: AsyncSession = Depends(get_async_db),
+    _auth=Depends(RequireAuth),
+):
+    # Registra un lote de movimientos (array JSON o NDJSON) en una única transacción
+    try:
+        return await crud.record_movements_bulk(
+            db, [(it.product_id, it.delta, it.reason) for it in items], [it.idempotency_key for it in items],
+        )
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=f"Producto no encontrado: {e.args[0]}")
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=f"Stock disponible insuficiente: {e.args[0]}")
+
+@router.get("/api/movements", response_model=list[MovementOut])
+async def api_list_movements(
+    request: Request,
+    params: MovementListParams = Depends(movement_list_params),
+    db: AsyncSession = Depends(get_async_read_db),
+    _auth=Depends(RequireAuth),
+):
+    # Lista movimientos de stock con filtros y paginación por cursor (cabecera X-Next-Cursor)
+    cond = conditional(request, await data_version_async(db))
+    if cond.response is not None:
+        return cond.response
+    return cond.store(*movements_page(await crud.list_movements(db, rows=FAST_SERIALIZATION, **params.filters()), params))
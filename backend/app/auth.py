@@ -8,12 +8,16 @@ from datetime import datetime, timedelta, timezone
 from typing import Annotated
 
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt, JWTError
-from passlib.context import CryptContext
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .database import get_db
+from .cache import TTLCache
+from .database import DB_ASYNC, get_async_db, get_db
+from .hashing import HashingPoolSaturated, hash_password_async, pwd_context, verify_password_async
 from .models import User
 from .schemas import Token, UserCreate, UserOut
 
@@ -22,10 +26,16 @@ JWT_SECRET = os.getenv("JWT_SECRET", "change_this_to_a_long_random_secret")  # C
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")  # Algoritmo de encriptación del token
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))  # Expiración del token en minutos
 REQUIRE_AUTH = os.getenv("REQUIRE_AUTH", "false").lower() == "true"  # Determina si la autenticación es obligatoria
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))  # Segundos que se recuerdan tokens verificados y usuarios (0 = sin caché)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))  # Máximo de entradas de cada caché
+# Confiar en los claims del token (sub + uid) sin consultar la tabla users en cada petición
+AUTH_TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() == "true"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")  # Contexto para encriptar contraseñas
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")  # URL de login para OAuth2
 
+_token_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)  # token -> claims ya verificados
+_user_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)  # email -> datos del usuario
+
 # --- Funciones de seguridad ---
 def hash_password(password: str) -> str:
     """Genera un hash seguro para la contraseña"""
@@ -42,26 +52,84 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)],
-    db: Session = Depends(get_db),
-) -> User:
-    """Devuelve el usuario actual según el token JWT, lanza error si no es válido"""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str) -> dict:
+    """
+    Valida el token JWT y devuelve sus claims; lanza 401 si no es válido.
+    Los tokens verificados se recuerdan hasta AUTH_CACHE_TTL segundos (nunca más allá de su exp, si lo tiene).
+    """
+    claims = _token_cache.get(token)
+    if claims is not None:
+        return claims
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        email: str | None = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.email == email).first()
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    claims = {"sub": payload["sub"], "uid": payload.get("uid")}
+    # Sin exp (tokens firmados fuera de create_access_token) el token no caduca: basta con AUTH_CACHE_TTL
+    exp = payload.get("exp")
+    _token_cache.set(token, claims, ttl=None if exp is None else exp - datetime.now(timezone.utc).timestamp())
+    return claims
+
+def email_from_token(token: str) -> str:
+    """Valida el token JWT y devuelve el email (claim sub); lanza 401 si no es válido"""
+    return decode_token(token)["sub"]
+
+def _cached_user(claims: dict) -> User | None:
+    # Usuario sin consultar la base de datos: desde los claims (si se confía en ellos) o desde la caché
+    if AUTH_TRUST_TOKEN_CLAIMS and claims["uid"] is not None:
+        return User(id=claims["uid"], email=claims["sub"])
+    data = _user_cache.get(claims["sub"])
+    return User(**data) if data is not None else None
+
+def _remember_user(user: User) -> None:
+    _user_cache.set(user.email, {"id": user.id, "email": user.email, "created_at": user.created_at})
+
+def invalidate_user(email: str) -> None:
+    """Olvida el usuario cacheado (se llama automáticamente al modificar o borrar un User)"""
+    _user_cache.pop(email)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_on_change(mapper, connection, target: User):
+    invalidate_user(target.email)
+    for old_email in inspect(target).attrs.email.history.deleted or ():
+        invalidate_user(old_email)
+
+def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: Session = Depends(get_db),
+) -> User:
+    """Devuelve el usuario actual según el token JWT, lanza error si no es válido"""
+    claims = decode_token(token)
+    user = _cached_user(claims)
     if user is None:
-        raise credentials_exception
+        user = db.query(User).filter(User.email == claims["sub"]).first()
+        if user is None:
+            raise _credentials_exception()
+        _remember_user(user)
+    return user
+
+async def get_current_user_async(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: AsyncSession = Depends(get_async_db),
+) -> User:
+    """Variante asíncrona de get_current_user (modo DB_ASYNC)"""
+    claims = decode_token(token)
+    user = _cached_user(claims)
+    if user is None:
+        user = (await db.execute(select(User).where(User.email == claims["sub"]))).scalars().first()
+        if user is None:
+            raise _credentials_exception()
+        _remember_user(user)
     return user
 
 def maybe_auth_dependency():
@@ -71,28 +139,95 @@ def maybe_auth_dependency():
     """
     def _noop():
         return None
-    return Depends(get_current_user) if REQUIRE_AUTH else Depends(_noop)
+    if not REQUIRE_AUTH:
+        return Depends(_noop)
+    return Depends(get_current_user_async if DB_ASYNC else get_current_user)
 
 # --- Rutas de autenticación ---
+# El hashing bcrypt se hace en el pool dedicado de hashing.py; si está saturado se responde 429
 from fastapi import APIRouter
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-@router.post("/register", response_model=UserOut)
-def register(payload: UserCreate, db: Session = Depends(get_db)):
-    """Registra un nuevo usuario con email y contraseña"""
-    if db.query(User).filter(User.email == payload.email).first():
-        raise HTTPException(status_code=400, detail="Email ya registrado")
-    user = User(email=payload.email, password_hash=hash_password(payload.password))
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Demasiadas peticiones de autenticación, reintenta en unos segundos",
+        headers={"Retry-After": "1"},
+    )
+
+def _user_by_email(db: Session, email: str) -> User | None:
+    return db.query(User).filter(User.email == email).first()
+
+def _save(db: Session, user: User) -> User:
     db.add(user)
     db.commit()
     db.refresh(user)
     return user
 
+@router.post("/register", response_model=UserOut)
+async def register(payload: UserCreate, db: Session = Depends(get_db)):
+    """Registra un nuevo usuario con email y contraseña"""
+    if await run_in_threadpool(_user_by_email, db, payload.email):
+        raise HTTPException(status_code=400, detail="Email ya registrado")
+    try:
+        password_hash = await hash_password_async(payload.password)
+    except HashingPoolSaturated:
+        raise _hashing_busy()
+    return await run_in_threadpool(_save, db, User(email=payload.email, password_hash=password_hash))
+
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    """Inicia sesión: verifica credenciales y devuelve un token JWT"""
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    """
+    Inicia sesión: verifica credenciales y devuelve un token JWT.
+    Si el hash se creó con otro coste de bcrypt (BCRYPT_ROUNDS) se rehace y se guarda.
+    """
+    user = await run_in_threadpool(_user_by_email, db, form_data.username)
+    if not user:
+        raise HTTPException(status_code=400, detail="Email o contraseña incorrectos")
+    try:
+        ok, new_hash = await verify_password_async(form_data.password, user.password_hash)
+    except HashingPoolSaturated:
+        raise _hashing_busy()
+    if not ok:
+        raise HTTPException(status_code=400, detail="Email o contraseña incorrectos")
+    token = create_access_token({"sub": user.email, "uid": user.id})
+    if new_hash:
+        user.password_hash = new_hash
+        await run_in_threadpool(db.commit)
+    return Token(access_token=token)
+
+# --- Rutas de autenticación en modo asíncrono (DB_ASYNC=true) ---
+async_router = APIRouter(prefix="/auth", tags=["auth"])
+
+@async_router.post("/register", response_model=UserOut)
+async def register_async(payload: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    """Registra un nuevo usuario con email y contraseña"""
+    if (await db.execute(select(User).where(User.email == payload.email))).scalars().first():
+        raise HTTPException(status_code=400, detail="Email ya registrado")
+    try:
+        password_hash = await hash_password_async(payload.password)
+    except HashingPoolSaturated:
+        raise _hashing_busy()
+    user = User(email=payload.email, password_hash=password_hash)
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
+
+@async_router.post("/login", response_model=Token)
+async def login_async(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    """Inicia sesión: verifica credenciales (y rehace el hash si cambió BCRYPT_ROUNDS) y devuelve un token JWT"""
+    user = (await db.execute(select(User).where(User.email == form_data.username))).scalars().first()
+    if not user:
+        raise HTTPException(status_code=400, detail="Email o contraseña incorrectos")
+    try:
+        ok, new_hash = await verify_password_async(form_data.password, user.password_hash)
+    except HashingPoolSaturated:
+        raise _hashing_busy()
+    if not ok:
         raise HTTPException(status_code=400, detail="Email o contraseña incorrectos")
-    token = create_access_token({"sub": user.email})
+    token = create_access_token({"sub": user.email, "uid": user.id})
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
     return Token(access_token=token)
@@ -0,0 +1,77 @@
+"""
+Índice en memoria del proceso de códigos de producto (EAN13 y SKU) -> ID, para el escaneo en los puestos de empaquetado.
+Se precarga en segundo plano al arrancar, se actualiza al crear productos y se acota a SCAN_INDEX_SIZE códigos (LRU).
+Es una pista, no la fuente de verdad: el UPDATE del escaneo comprueba que el código sigue siendo del producto,
+así que una entrada obsoleta (EAN13 cambiado por una importación u otro worker) solo cuesta una resolución más.
+"""
+
+import logging
+import os
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from .cache import TTLCache
+from .models import Product
+
+SCAN_INDEX_SIZE = int(os.getenv("SCAN_INDEX_SIZE", "200000"))  # Códigos (EAN13 y SKU) en memoria como máximo
+SCAN_INDEX_TTL = float(os.getenv("SCAN_INDEX_TTL", "86400"))  # Segundos que se conserva un código sin volver a leerlo
+
+logger = logging.getLogger(__name__)
+
+_codes = TTLCache(SCAN_INDEX_SIZE, SCAN_INDEX_TTL)  # EAN13 o SKU -> ID de producto
+
+def lookup(code: str) -> int | None:
+    return _codes.get(code)
+
+def remember(product_id: int, sku: str, ean13: str) -> None:
+    _codes.set(ean13, product_id)
+    _codes.set(sku, product_id)
+
+def forget(*codes: str) -> None:
+    for code in codes:
+        _codes.pop(code)
+
+def clear() -> None:
+    _codes.clear()
+
+def resolve(db: Session, code: str) -> int | None:
+    """
+    Busca el producto de un código en la base de datos (índices únicos de ean13 y sku) y lo guarda en el índice.
+    Si el código es el EAN13 de un producto y el SKU de otro, gana el EAN13.
+    """
+    rows = db.execute(
+        select(Product.id, Product.sku, Product.ean13).where(or_(Product.ean13 == code, Product.sku == code))
+    ).all()
+    if not rows:
+        return None
+    product_id, sku, ean13 = min(rows, key=lambda r: r.ean13 != code)
+    remember(product_id, sku, ean13)
+    return product_id
+
+def warm(db: Session, limit: int | None = None) -> int:
+    """Precarga los productos actualizados más recientemente (hasta llenar el índice); devuelve cuántos"""
+    limit = SCAN_INDEX_SIZE // 2 if limit is None else limit
+    rows = db.execute(
+        select(Product.id, Product.sku, Product.ean13)
+        .order_by(Product.updated_at.desc(), Product.id.desc())
+        .limit(limit)
+    ).all()
+    # Del menos al más reciente: si el índice se llena, el LRU descarta primero los más antiguos
+    for product_id, sku, ean13 in reversed(rows):
+        remember(product_id, sku, ean13)
+    logger.info("Índice de códigos precargado con %d productos", len(rows))
+    return len(rows)
+
+async def warm_in_background(session_factory):
+    """Precarga del índice como tarea del lifespan: el arranque no espera a la base de datos"""
+    def run_once():
+        with session_factory() as db:
+            warm(db)
+
+    try:
+        await run_in_threadpool(run_once)
+    except Exception:
+        # Sin precarga el índice se llena con los escaneos (cada código desconocido se resuelve una vez)
+        logger.exception("Error al precargar el índice de códigos")
@@ -3,15 +3,58 @@ Gestiona operaciones de inventario: productos y movimientos de stock.
 Incluye funciones para listar, crear productos, registrar movimientos y ajustar stock.
 """
 
+from datetime import datetime
+
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import Row, Select, Update, select, update, insert, case, or_, tuple_
 from .models import Product, StockMovement
+from . import barcodes
+from .events import queue_events
+from .http_cache import invalidate_responses
+from .idempotency import bind_keys, merge_lines, replayed_lines
+
+PRODUCT_FIELDS = ("id", "sku", "ean13", "name", "stock_qty", "created_at", "updated_at")  # Columnas proyectables
+MOVEMENT_FIELDS = ("id", "product_id", "delta", "qty_before", "qty_after", "reason", "type", "created_at")  # Columnas de MovementOut
+
+class InsufficientStock(Exception):
+    """No hay disponible suficiente (stock - reservado) para la salida o la reserva"""
+
+def select_products(
+    limit: int | None = None,
+    after_id: int | None = None,
+    sku_prefix: str | None = None,
+    name: str | None = None,
+    stock_below: int | None = None,
+    updated_since: datetime | None = None,
+    fields: tuple[str, ...] = PRODUCT_FIELDS,
+) -> Select:
+    """
+    Construye la consulta del listado de productos ordenados por ID ascendente.
+    - Selecciona solo las columnas pedidas en fields (filas, no entidades ORM).
+    - Filtros: prefijo de SKU, texto en el nombre, stock por debajo de un umbral y fecha de actualización.
+    - after_id/limit: paginación por keyset sobre la clave primaria.
+    """
+    q = select(*(getattr(Product, f) for f in fields)).order_by(Product.id.asc())
+    if after_id is not None:
+        q = q.where(Product.id > after_id)
+    if sku_prefix:
+        q = q.where(Product.sku.startswith(sku_prefix, autoescape=True))
+    if name:
+        q = q.where(Product.name.icontains(name, autoescape=True))
+    if stock_below is not None:
+        q = q.where(Product.stock_qty < stock_below)
+    if updated_since:
+        q = q.where(Product.updated_at >= updated_since)
+    if limit is not None:
+        q = q.limit(limit)
+    return q
 
-def list_products(db: Session) -> list[Product]:
+def list_products(db: Session, **filters) -> list[Row]:
     
-    # Devuelve todos los productos de la base de datos ordenados por ID ascendente.
+    # Devuelve los productos según los filtros de select_products.
     
-    return db.execute(select(Product).order_by(Product.id.asc())).scalars().all()
+    return db.execute(select_products(**filters)).all()
 
 def get_product(db: Session, product_id: int) -> Product | None:
     
@@ -33,50 +76,219 @@ def create_product(db: Session, sku: str, ean13: str, name: str, stock_qty: int
     p = Product(sku=sku, ean13=ean13, name=name, stock_qty=stock_qty)
     db.add(p)
     db.commit()
+    invalidate_responses()
     db.refresh(p)
+    barcodes.remember(p.id, p.sku, p.ean13)
     return p
 
-def record_movement(db: Session, product: Product, delta: int, reason: str | None, mtype: str) -> StockMovement:
+def stock_delta_stmt(product_id: int, delta: int) -> Update:
     """
-    Registra un movimiento de stock para un producto.
-    - delta: cantidad a sumar (+) o restar (-)
-    - reason: motivo del movimiento (opcional)
-    - mtype: tipo de movimiento ('IN', 'OUT' o 'ADJUST')
-    Actualiza la cantidad de stock del producto y crea un registro en StockMovement.
+    Suma delta al stock de un producto de forma atómica en la base de datos
+    (UPDATE ... SET stock_qty = stock_qty + :delta RETURNING stock_qty).
+    La fila queda bloqueada hasta el commit, así que escritores concurrentes sobre el mismo
+    producto se ordenan entre sí sin bloquear el resto de la tabla.
+    Una salida solo se aplica si cabe en el disponible (stock_qty - reserved_qty): las unidades reservadas
+    no se pueden consumir fuera de su reserva. Sin fila devuelta = no cabe (o el producto no existe).
     """
-    before = product.stock_qty
-    after = product.stock_qty + delta
-    product.stock_qty = after
-    m = StockMovement(
-        product_id=product.id,
+    stmt = update(Product).where(Product.id == product_id)
+    if delta < 0:
+        stmt = stmt.where(Product.stock_qty - Product.reserved_qty >= -delta)
+    return (
+        stmt.values(stock_qty=Product.stock_qty + delta)
+        .returning(Product.stock_qty)
+        .execution_options(synchronize_session=False)
+    )
+
+def stock_lock_stmt(product_id: int) -> Update:
+    """
+    Lee el stock actual bloqueando la fila: UPDATE sin cambios con RETURNING,
+    válido tanto en PostgreSQL como en SQLite (que no soporta SELECT ... FOR UPDATE).
+    """
+    return (
+        update(Product)
+        .where(Product.id == product_id)
+        .values(stock_qty=Product.stock_qty)
+        .returning(Product.stock_qty)
+        .execution_options(synchronize_session=False)
+    )
+
+def movement_for(product_id: int, after: int, delta: int, reason: str | None, mtype: str) -> StockMovement:
+    # Movimiento a partir del stock resultante devuelto por stock_delta_stmt
+    return StockMovement(
+        product_id=product_id,
         delta=delta,
-        qty_before=before,
+        qty_before=after - delta,
         qty_after=after,
         reason=reason,
         type=mtype
     )
+
+def record_movement(
+    db: Session, product: Product, delta: int, reason: str | None, mtype: str, idempotency_key: str | None = None,
+) -> StockMovement:
+    """
+    Registra un movimiento de stock para un producto.
+    - delta: cantidad a sumar (+) o restar (-)
+    - reason: motivo del movimiento (opcional)
+    - mtype: tipo de movimiento ('IN', 'OUT' o 'ADJUST')
+    - idempotency_key: clave ya reservada con idempotency.replay_movement; se asocia al movimiento en la misma transacción
+    Actualiza la cantidad de stock del producto y crea un registro en StockMovement.
+    El stock se calcula en la base de datos (no a partir del valor leído en Python),
+    por lo que qty_before/qty_after son correctos aunque haya varios workers escribiendo a la vez.
+    El movimiento se difunde a los suscriptores en tiempo real al confirmar la transacción.
+    Lanza InsufficientStock (sin aplicar nada) si una salida consumiría stock reservado.
+    """
+    after = db.execute(stock_delta_stmt(product.id, delta)).scalar()
+    if after is None:
+        db.rollback()
+        raise InsufficientStock(product.id)
+    m = movement_for(product.id, after, delta, reason, mtype)
     db.add(m)
+    db.flush()
+    if idempotency_key is not None:
+        bind_keys(db, {idempotency_key: m.id})
+    queue_events(db, [m])
     db.commit()
+    invalidate_responses()
     db.refresh(m)
-    db.refresh(product)
+    set_committed_value(product, "stock_qty", after)  # Sin SELECT extra: ya conocemos el stock final
     return m
 
 def set_stock(db: Session, product: Product, quantity: int, reason: str | None) -> StockMovement:
     """
     Ajusta el stock de un producto a una cantidad exacta.
     Crea un movimiento de tipo 'ADJUST' registrando la diferencia entre el stock actual y la nueva cantidad.
+    El stock actual se lee bloqueando la fila (stock_lock_stmt), de modo que el delta
+    no se calcula sobre un valor obsoleto. Lanza InsufficientStock si la cantidad es menor que lo reservado.
     """
-    delta = quantity - product.stock_qty
-    return record_movement(db, product, delta=delta, reason=reason, mtype="ADJUST")
+    current = db.execute(stock_lock_stmt(product.id)).scalar_one()
+    return record_movement(db, product, delta=quantity - current, reason=reason, mtype="ADJUST")
+
+def bulk_totals(items: list[tuple[int, int, str | None]]) -> dict[int, int]:
+    # Suma de deltas por producto dentro de un lote
+    totals: dict[int, int] = {}
+    for product_id, delta, _ in items:
+        totals[product_id] = totals.get(product_id, 0) + delta
+    return totals
 
-def list_movements(db: Session, product_id: int | None = None, limit: int = 100) -> list[StockMovement]:
+def bulk_update_stmt(totals: dict[int, int], now: datetime) -> Update:
+    # Un único UPDATE para todos los productos del lote: stock_qty + CASE id WHEN ... THEN delta.
+    # Como en stock_delta_stmt, los productos con salida neta solo se actualizan si cabe en el disponible.
+    delta = case(totals, value=Product.id, else_=0)
+    return (
+        update(Product)
+        .where(Product.id.in_(totals), or_(delta >= 0, Product.stock_qty - Product.reserved_qty >= -delta))
+        .values(stock_qty=Product.stock_qty + delta, updated_at=now)
+        .returning(Product.id, Product.stock_qty)
+        .execution_options(synchronize_session=False)
+    )
+
+def bulk_error(missing: list[int], existing: set[int]) -> Exception:
+    # Productos que el UPDATE del lote no devolvió: LookupError si alguno no existe, si no, falta disponible
+    not_found = [pid for pid in missing if pid not in existing]
+    return LookupError(not_found) if not_found else InsufficientStock(missing)
+
+def bulk_rows(items: list[tuple[int, int, str | None]], totals: dict[int, int], after_totals: dict[int, int], now: datetime) -> list[dict]:
+    """
+    Filas de stock_movements de un lote, con qty_before/qty_after de cada línea
+    calculados a partir del stock resultante de cada producto (after_totals).
     """
-    Lista movimientos de stock.
-    - Se pueden filtrar por ID de producto.
-    - Se limita el número de resultados (por defecto 100) ordenados por fecha descendente.
+    # Stock de partida de cada producto antes del lote; se avanza línea a línea
+    running = {pid: after_totals[pid] - totals[pid] for pid in totals}
+    rows = []
+    for product_id, delta, reason in items:
+        before = running[product_id]
+        running[product_id] = before + delta
+        rows.append({
+            "product_id": product_id,
+            "delta": delta,
+            "qty_before": before,
+            "qty_after": before + delta,
+            "reason": reason,
+            "type": "IN" if delta >= 0 else "OUT",
+            "created_at": now,
+        })
+    return rows
+
+BULK_INSERT = insert(StockMovement).returning(StockMovement.id, sort_by_parameter_order=True)
+
+def record_movements_bulk(
+    db: Session, items: list[tuple[int, int, str | None]], keys: list[str | None] | None = None,
+) -> list[dict]:
     """
-    q = select(StockMovement).order_by(StockMovement.created_at.desc())
+    Registra un lote de movimientos en una sola transacción.
+    - items: tuplas (product_id, delta, reason) en el orden en que llegaron.
+    - keys: clave de idempotencia de cada línea (o None); las líneas ya registradas con su clave
+      no se vuelven a aplicar y devuelven el movimiento original.
+    Agrupa los deltas por producto, aplica un único UPDATE por conjunto (stock_qty + CASE)
+    y un INSERT multi-fila en stock_movements. Calcula qty_before/qty_after de cada línea
+    a partir del stock resultante devuelto por el UPDATE.
+    Lanza LookupError con los IDs inexistentes (sin aplicar nada) si algún producto no existe
+    e InsufficientStock si la salida neta de algún producto consumiría stock reservado.
+    """
+    if not items:
+        return []
+
+    replayed = replayed_lines(db, items, keys) if keys and any(keys) else {}
+    applied = [i for i in range(len(items)) if i not in replayed]
+    lines = [items[i] for i in applied]
+    rows = []
+    if lines:
+        totals = bulk_totals(lines)
+        now = datetime.utcnow()
+        after_totals = dict(db.execute(bulk_update_stmt(totals, now)).all())
+        missing = sorted(set(totals) - set(after_totals))
+        if missing:
+            existing = set(db.execute(select(Product.id).where(Product.id.in_(missing))).scalars())
+            db.rollback()
+            raise bulk_error(missing, existing)
+
+        rows = bulk_rows(lines, totals, after_totals, now)
+        ids = db.execute(BULK_INSERT, rows).scalars().all()
+        for row, movement_id in zip(rows, ids):
+            row["id"] = movement_id
+        if keys:
+            bind_keys(db, {keys[i]: row["id"] for i, row in zip(applied, rows) if keys[i] is not None})
+        queue_events(db, rows)
+    db.commit()
+    if rows:
+        invalidate_responses()
+    return merge_lines(len(items), applied, rows, replayed) if replayed else rows
+
+def select_movements(
+    product_id: int | None = None,
+    limit: int = 100,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    mtype: str | None = None,
+    after: tuple[datetime, int] | None = None,
+    rows: bool = False,
+) -> Select:
+    """
+    Construye la consulta del listado de movimientos de stock.
+    - Se pueden filtrar por ID de producto, tipo y rango de fechas [since, until).
+    - Se limita el número de resultados (por defecto 100) ordenados por fecha e ID descendentes.
+    - after: clave (created_at, id) de la última fila de la página anterior (paginación por keyset).
+      Cada página es un rango del índice (product_id, created_at, id), sin OFFSET.
+    - rows: seleccionar las columnas de MOVEMENT_FIELDS (filas) en lugar de entidades ORM.
+    """
+    q = select(*(getattr(StockMovement, f) for f in MOVEMENT_FIELDS)) if rows else select(StockMovement)
+    q = q.order_by(StockMovement.created_at.desc(), StockMovement.id.desc())
     if product_id:
         q = q.where(StockMovement.product_id == product_id)
-    q = q.limit(limit)
-    return db.execute(q).scalars().all()
+    if mtype:
+        q = q.where(StockMovement.type == mtype)
+    if since:
+        q = q.where(StockMovement.created_at >= since)
+    if until:
+        q = q.where(StockMovement.created_at < until)
+    if after:
+        q = q.where(tuple_(StockMovement.created_at, StockMovement.id) < tuple_(*after))
+    return q.limit(limit)
+
+def list_movements(db: Session, rows: bool = False, **filters) -> list[StockMovement] | list[Row]:
+    
+    # Lista movimientos de stock según los filtros de select_movements (filas con rows=True).
+    
+    result = db.execute(select_movements(rows=rows, **filters))
+    return result.all() if rows else result.scalars().all()
@@ -0,0 +1,126 @@
+"""
+Versiones asíncronas (AsyncSession) de las operaciones de inventario de crud.py.
+Reutilizan las mismas consultas y sentencias, así que ambos modos se comportan igual.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import Row, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .crud import (
+    BULK_INSERT, InsufficientStock, bulk_error, bulk_rows, bulk_totals, bulk_update_stmt, movement_for,
+    select_movements, select_products, stock_delta_stmt, stock_lock_stmt,
+)
+from . import barcodes
+from .events import queue_events
+from .http_cache import invalidate_responses
+from .idempotency import bind_keys, merge_lines, replayed_lines
+from .models import Product, StockMovement
+
+async def list_products(db: AsyncSession, **filters) -> list[Row]:
+    
+    # Devuelve los productos según los filtros de crud.select_products.
+    
+    return (await db.execute(select_products(**filters))).all()
+
+async def get_product(db: AsyncSession, product_id: int) -> Product | None:
+    
+    # Recupera un producto por su ID. Devuelve None si no existe.
+    
+    return await db.get(Product, product_id)
+
+async def get_product_by_sku(db: AsyncSession, sku: str) -> Product | None:
+    
+    # Recupera un producto por su SKU. Devuelve None si no existe.
+    
+    return (await db.execute(select(Product).where(Product.sku == sku))).scalars().first()
+
+async def create_product(db: AsyncSession, sku: str, ean13: str, name: str, stock_qty: int = 0) -> Product:
+    """
+    Crea un nuevo producto con el SKU, EAN13, nombre y cantidad inicial de stock.
+    Guarda el producto en la base de datos y lo devuelve.
+    """
+    p = Product(sku=sku, ean13=ean13, name=name, stock_qty=stock_qty)
+    db.add(p)
+    await db.commit()
+    invalidate_responses()
+    await db.refresh(p)
+    barcodes.remember(p.id, p.sku, p.ean13)
+    return p
+
+async def record_movement(
+    db: AsyncSession, product: Product, delta: int, reason: str | None, mtype: str, idempotency_key: str | None = None,
+) -> StockMovement:
+    """
+    Registra un movimiento de stock para un producto (ver crud.record_movement).
+    El stock se actualiza de forma atómica con UPDATE ... RETURNING.
+    Lanza InsufficientStock si una salida consumiría stock reservado.
+    """
+    after = (await db.execute(stock_delta_stmt(product.id, delta))).scalar()
+    if after is None:
+        await db.rollback()
+        raise InsufficientStock(product.id)
+    m = movement_for(product.id, after, delta, reason, mtype)
+    db.add(m)
+    await db.flush()
+    if idempotency_key is not None:
+        await db.run_sync(bind_keys, {idempotency_key: m.id})
+    queue_events(db.sync_session, [m])
+    await db.commit()
+    invalidate_responses()
+    await db.refresh(m)
+    set_committed_value(product, "stock_qty", after)
+    return m
+
+async def set_stock(db: AsyncSession, product: Product, quantity: int, reason: str | None) -> StockMovement:
+    """
+    Ajusta el stock de un producto a una cantidad exacta (ver crud.set_stock).
+    Crea un movimiento de tipo 'ADJUST' con la diferencia respecto al stock actual bloqueado.
+    """
+    current = (await db.execute(stock_lock_stmt(product.id))).scalar_one()
+    return await record_movement(db, product, delta=quantity - current, reason=reason, mtype="ADJUST")
+
+async def record_movements_bulk(
+    db: AsyncSession, items: list[tuple[int, int, str | None]], keys: list[str | None] | None = None,
+) -> list[dict]:
+    """
+    Registra un lote de movimientos en una sola transacción (ver crud.record_movements_bulk).
+    Lanza LookupError con los IDs inexistentes si algún producto no existe e InsufficientStock si falta disponible.
+    """
+    if not items:
+        return []
+
+    replayed = await db.run_sync(replayed_lines, items, keys) if keys and any(keys) else {}
+    applied = [i for i in range(len(items)) if i not in replayed]
+    lines = [items[i] for i in applied]
+    rows = []
+    if lines:
+        totals = bulk_totals(lines)
+        now = datetime.utcnow()
+        after_totals = dict((await db.execute(bulk_update_stmt(totals, now))).all())
+        missing = sorted(set(totals) - set(after_totals))
+        if missing:
+            existing = set((await db.execute(select(Product.id).where(Product.id.in_(missing)))).scalars())
+            await db.rollback()
+            raise bulk_error(missing, existing)
+
+        rows = bulk_rows(lines, totals, after_totals, now)
+        ids = (await db.execute(BULK_INSERT, rows)).scalars().all()
+        for row, movement_id in zip(rows, ids):
+            row["id"] = movement_id
+        if keys:
+            await db.run_sync(bind_keys, {keys[i]: row["id"] for i, row in zip(applied, rows) if keys[i] is not None})
+        queue_events(db.sync_session, rows)
+    await db.commit()
+    if rows:
+        invalidate_responses()
+    return merge_lines(len(items), applied, rows, replayed) if replayed else rows
+
+async def list_movements(db: AsyncSession, rows: bool = False, **filters) -> list[StockMovement] | list[Row]:
+    
+    # Lista movimientos de stock según los filtros de crud.select_movements (filas con rows=True).
+    
+    result = await db.execute(select_movements(rows=rows, **filters))
+    return result.all() if rows else result.scalars().all()
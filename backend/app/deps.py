@@ -1,12 +1,181 @@
 """
-Define la dependencia de autenticación para las rutas de la API.
+Define las dependencias compartidas por las rutas de la API (síncronas y asíncronas):
+autenticación, parámetros de los listados paginados y lectura de lotes de movimientos.
 """
 
+import json
 import os
-from fastapi import Depends
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Literal
+
+from fastapi import HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import Row
+
 from .auth import maybe_auth_dependency
+from .crud import PRODUCT_FIELDS
+from .pagination import encode_cursor, decode_cursor
+from .schemas import MovementCreate, MovementOut, ProductOut
+
+try:  # Dependencia opcional
+    import orjson
+except ImportError:
+    orjson = None
+
+MAX_BULK_MOVEMENTS = int(os.getenv("MAX_BULK_MOVEMENTS", "10000"))  # Máximo de líneas por lote en /api/movements/bulk
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "false").lower() == "true"  # Listados serializados desde filas (orjson)
+
+# Dependencia que aplica autenticación solo si REQUIRE_AUTH=true (las rutas la usan como Depends(RequireAuth))
+RequireAuth = maybe_auth_dependency().dependency
+
+# ------- Listado de productos -------
+@dataclass
+class ProductListParams:
+    limit: int
+    after_id: int | None
+    sku_prefix: str | None
+    name: str | None
+    stock_below: int | None
+    updated_since: datetime | None
+    fields: tuple[str, ...]
+
+    def filters(self) -> dict:
+        # Argumentos para crud.select_products
+        return vars(self).copy()
+
+def product_list_params(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    sku_prefix: str | None = None,
+    q: str | None = None,
+    stock_below: int | None = None,
+    updated_since: datetime | None = None,
+    fields: str | None = Query(None, description="Columnas separadas por comas, p. ej. id,sku,stock_qty"),
+) -> ProductListParams:
+    # Valida el cursor y la proyección de columnas de GET /api/products (el ID siempre se incluye)
+    after_id = None
+    if cursor:
+        try:
+            (after_id,) = decode_cursor(cursor)
+            after_id = int(after_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    columns = PRODUCT_FIELDS
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = sorted(set(requested) - set(PRODUCT_FIELDS))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(unknown)}")
+        columns = tuple(f for f in PRODUCT_FIELDS if f == "id" or f in requested)
+    return ProductListParams(limit, after_id, sku_prefix, q, stock_below, updated_since, columns)
+
+_products_json = TypeAdapter(list[ProductOut])
+_movements_json = TypeAdapter(list[MovementOut])
+_rows_json = TypeAdapter(list[dict[str, Any]])
+
+def encode_rows(rows: list[Row]) -> bytes:
+    """
+    JSON de un listado directamente desde las filas de la consulta (FAST_SERIALIZATION=true),
+    sin entidades ORM ni validación fila a fila con ProductOut/MovementOut: las columnas ya tienen
+    los tipos del esquema y se codifican con orjson (o con pydantic-core si no está instalado).
+    El resultado es el mismo JSON, byte a byte, que el de la ruta normal.
+    """
+    if not rows:
+        return b"[]"
+    keys = rows[0]._fields
+    data = [dict(zip(keys, r)) for r in rows]
+    return orjson.dumps(data) if orjson is not None else _rows_json.dump_json(data)
+
+def products_page(rows: list[Row], params: ProductListParams) -> tuple[bytes, dict[str, str]]:
+    """
+    Cuerpo JSON y cabeceras de GET /api/products (se guardan tal cual en la caché de respuestas):
+    X-Next-Cursor si la página está llena y, con fields=, solo las columnas pedidas (sin pasar por ProductOut).
+    """
+    headers = {}
+    if len(rows) == params.limit:
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1].id)
+    if FAST_SERIALIZATION:
+        return encode_rows(rows), headers
+    if params.fields != PRODUCT_FIELDS:
+        data = jsonable_encoder([r._asdict() for r in rows])
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(), headers
+    return _products_json.dump_json(_products_json.validate_python(rows, from_attributes=True)), headers
+
+# ------- Listado de movimientos -------
+@dataclass
+class MovementListParams:
+    product_id: int | None
+    limit: int
+    since: datetime | None
+    until: datetime | None
+    mtype: str | None
+    after: tuple[datetime, int] | None
+
+    def filters(self) -> dict:
+        # Argumentos para crud.select_movements
+        return vars(self).copy()
+
+def movement_list_params(
+    product_id: int | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    mtype: Literal["IN", "OUT", "ADJUST"] | None = Query(None, alias="type"),
+    cursor: str | None = None,
+) -> MovementListParams:
+    # Valida el cursor (created_at, id) de GET /api/movements
+    after = None
+    if cursor:
+        try:
+            created_at, movement_id = decode_cursor(cursor)
+            after = (datetime.fromisoformat(created_at), int(movement_id))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    return MovementListParams(product_id, limit, since, until, mtype, after)
+
+def movements_page(movements: list, params: MovementListParams) -> tuple[bytes, dict[str, str]]:
+    # Cuerpo JSON y cabecera X-Next-Cursor (si la página está llena) de GET /api/movements.
+    # Con FAST_SERIALIZATION las rutas pasan filas (crud.list_movements(rows=True)) en lugar de entidades.
+    headers = {}
+    if len(movements) == params.limit:
+        last = movements[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+    if movements and isinstance(movements[0], Row):
+        return encode_rows(movements), headers
+    return _movements_json.dump_json(_movements_json.validate_python(movements, from_attributes=True)), headers
 
-# Devuelve la dependencia que aplica autenticación solo si REQUIRE_AUTH=true
+# ------- Lotes de movimientos -------
+_movement_batch = TypeAdapter(list[MovementCreate])
 
-RequireAuth = maybe_auth_dependency  
+def parse_movement_batch(body: bytes, content_type: str) -> list[MovementCreate]:
+    """
+    Interpreta el cuerpo de /api/movements/bulk: un array JSON o NDJSON (un objeto por línea).
+    Los errores de validación se devuelven como 422 indicando la línea afectada.
+    """
+    try:
+        if "ndjson" in content_type:
+            items = []
+            errors = []
+            for lineno, line in enumerate(body.splitlines()):
+                if not line.strip():
+                    continue
+                try:
+                    items.append(MovementCreate.model_validate_json(line))
+                except ValidationError as e:
+                    errors.extend({**err, "loc": ("body", lineno, *err["loc"])} for err in e.errors(include_url=False))
+            if errors:
+                raise RequestValidationError(errors)
+            return items
+        return _movement_batch.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)])
 
+async def movement_batch(request: Request) -> list[MovementCreate]:
+    # Lee y valida el lote de /api/movements/bulk, limitado a MAX_BULK_MOVEMENTS líneas
+    items = parse_movement_batch(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > MAX_BULK_MOVEMENTS:
+        raise HTTPException(status_code=413, detail=f"Máximo {MAX_BULK_MOVEMENTS} movimientos por lote")
+    return items
@@ -0,0 +1,255 @@
+"""
+Canal en tiempo real de movimientos de stock (Server-Sent Events).
+Cada movimiento confirmado se difunde a los suscriptores de este worker; cada suscriptor tiene
+una cola acotada y, si no la vacía a tiempo, se descartan sus eventos más antiguos: un cliente lento
+nunca bloquea a los escritores. Con EVENTS_PG_NOTIFY=true (PostgreSQL) los eventos se envían con
+NOTIFY dentro de la transacción y cada worker los recibe con LISTEN, de modo que llegan a los
+suscriptores de todos los workers.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import select as select_module
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from . import auth
+from .database import get_db
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))  # Eventos pendientes por suscriptor
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))  # Segundos entre comentarios keep-alive
+EVENTS_PG_NOTIFY = os.getenv("EVENTS_PG_NOTIFY", "false").lower() == "true"
+EVENTS_CHANNEL = "stock_movements"
+NOTIFY_MAX_PAYLOAD = 7900  # PostgreSQL limita el payload de NOTIFY a 8000 bytes
+
+logger = logging.getLogger(__name__)
+
+@dataclass(eq=False)
+class Subscriber:
+    queue: asyncio.Queue
+    product_ids: frozenset[int] | None = None  # None = todos los productos
+    dropped: int = 0  # Eventos descartados por cola llena (el cliente debería recargar)
+
+    def wants(self, event: dict) -> bool:
+        return self.product_ids is None or event["product_id"] in self.product_ids
+
+@dataclass
+class Broadcaster:
+    queue_size: int
+    subscribers: set[Subscriber] = field(default_factory=set)
+    loop: asyncio.AbstractEventLoop | None = None
+
+    def subscribe(self, product_ids: list[int] | None = None) -> Subscriber:
+        """Registra un suscriptor (desde el event loop del servidor)"""
+        self.loop = asyncio.get_running_loop()
+        sub = Subscriber(asyncio.Queue(self.queue_size), frozenset(product_ids) if product_ids else None)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self.subscribers.discard(sub)
+
+    def publish(self, events: list[dict]) -> None:
+        """Difunde eventos; se puede llamar desde cualquier hilo y nunca espera"""
+        loop = self.loop
+        if not self.subscribers or loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(events)
+        else:
+            loop.call_soon_threadsafe(self._deliver, events)
+
+    def _deliver(self, events: list[dict]) -> None:
+        # Siempre en el event loop: las colas asyncio no son seguras entre hilos
+        for sub in list(self.subscribers):
+            for ev in events:
+                if not sub.wants(ev):
+                    continue
+                if sub.queue.full():
+                    sub.queue.get_nowait()  # Descarta el más antiguo
+                    sub.dropped += 1
+                sub.queue.put_nowait(ev)
+
+broadcaster = Broadcaster(EVENTS_QUEUE_SIZE)
+
+def movement_event(m) -> dict:
+    """Evento de un movimiento (objeto StockMovement o fila del lote de crud.record_movements_bulk)"""
+    get = m.get if isinstance(m, dict) else lambda k: getattr(m, k)
+    created_at = get("created_at")
+    return {
+        "id": get("id"),
+        "product_id": get("product_id"),
+        "delta": get("delta"),
+        "qty_before": get("qty_before"),
+        "qty_after": get("qty_after"),
+        "reason": get("reason"),
+        "type": get("type"),
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+    }
+
+# ------- Publicación ligada a la transacción -------
+_PENDING = "stock_events"  # Clave en Session.info
+
+def events_enabled() -> bool:
+    # Sin suscriptores locales ni NOTIFY no merece la pena construir los eventos
+    return EVENTS_PG_NOTIFY or bool(broadcaster.subscribers)
+
+def queue_events(session: Session, movements) -> None:
+    """
+    Anota los movimientos de la transacción en curso; se publican al confirmarla
+    y se descartan si se deshace. Para AsyncSession se pasa db.sync_session.
+    """
+    if events_enabled():
+        session.info.setdefault(_PENDING, []).extend(movement_event(m) for m in movements)
+
+def _notify_payloads(events: list[dict]) -> list[str]:
+    # Agrupa los eventos en payloads JSON por debajo del límite de NOTIFY
+    payloads, batch, size = [], [], 2
+    for ev in events:
+        data = json.dumps(ev)
+        if batch and size + len(data) + 1 > NOTIFY_MAX_PAYLOAD:
+            payloads.append(f"[{','.join(batch)}]")
+            batch, size = [], 2
+        batch.append(data)
+        size += len(data) + 1
+    if batch:
+        payloads.append(f"[{','.join(batch)}]")
+    return payloads
+
+@event.listens_for(Session, "before_commit")
+def _notify_before_commit(session: Session):
+    # Con NOTIFY los eventos viajan en la propia transacción: PostgreSQL los entrega solo si se confirma
+    if not EVENTS_PG_NOTIFY or not session.info.get(_PENDING):
+        return
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    conn = session.connection()
+    for payload in _notify_payloads(session.info.pop(_PENDING)):
+        conn.execute(select(func.pg_notify(EVENTS_CHANNEL, payload)))
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session: Session):
+    events = session.info.pop(_PENDING, None)
+    if events:
+        broadcaster.publish(events)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session):
+    session.info.pop(_PENDING, None)
+
+# ------- LISTEN (varios workers) -------
+class PgListener:
+    """Hilo con una conexión dedicada en LISTEN que reenvía las notificaciones al broadcaster local"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="pg-listen", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Error en LISTEN %s; reintentando", EVENTS_CHANNEL)
+                self._stop.wait(1)
+
+    def _listen(self) -> None:
+        raw = self.engine.raw_connection()
+        raw.detach()  # Conexión propia, fuera del pool
+        conn = raw.driver_connection
+        try:
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {EVENTS_CHANNEL}")
+            while not self._stop.is_set():
+                if select_module.select([conn], [], [], 1.0)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        broadcaster.publish(json.loads(conn.notifies.pop(0).payload))
+        finally:
+            raw.close()
+
+def start_listener(engine) -> PgListener | None:
+    """Arranca LISTEN si EVENTS_PG_NOTIFY=true y la base de datos es PostgreSQL (psycopg2)"""
+    if not EVENTS_PG_NOTIFY or engine.dialect.name != "postgresql":
+        return None
+    listener = PgListener(engine)
+    listener.start()
+    return listener
+
+# ------- Ruta SSE -------
+router = APIRouter(prefix="/api/events", tags=["events"])
+
+def stream_auth(request: Request, token: str | None = None, db: Session = Depends(get_db)):
+    """
+    Autenticación del stream: EventSource no permite cabeceras,
+    así que el token puede ir en la cabecera Authorization o en ?token=.
+    """
+    if not auth.REQUIRE_AUTH:
+        return None
+    header = request.headers.get("Authorization", "")
+    if header.lower().startswith("bearer "):
+        token = header[7:]
+    if not token:
+        raise auth._credentials_exception()
+    return auth.get_current_user(token, db)
+
+def sse(event: str, data: dict, event_id: int | None = None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+async def sse_stream(request: Request, sub: Subscriber, keepalive: float = EVENTS_KEEPALIVE):
+    """
+    Envía los eventos del suscriptor como SSE. Si se han descartado eventos por cola llena se avisa
+    con un evento "dropped" para que el cliente recargue los datos.
+    """
+    try:
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            try:
+                ev = await asyncio.wait_for(sub.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if sub.dropped:
+                yield sse("dropped", {"count": sub.dropped})
+                sub.dropped = 0
+            yield sse("movement", ev, ev["id"])
+    finally:
+        broadcaster.unsubscribe(sub)
+
+@router.get("/movements")
+async def movement_events(
+    request: Request,
+    product_id: list[int] | None = Query(None),
+    _auth=Depends(stream_auth),
+):
+    """Stream SSE de movimientos confirmados, opcionalmente solo de algunos productos (?product_id=1&product_id=2)"""
+    sub = broadcaster.subscribe(product_id)
+    return StreamingResponse(
+        sse_stream(request, sub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,107 @@
+"""
+Exportación en streaming (CSV o NDJSON) de productos e historial de movimientos.
+Las filas se leen con cursores del lado del servidor (yield_per) y se envían por bloques,
+así que la memoria usada no depende del tamaño del resultado. Los movimientos de meses archivados
+(app.archive) se leen de sus ficheros y se intercalan en orden con los de la base de datos.
+"""
+
+import csv
+import heapq
+import io
+import json
+import os
+from datetime import datetime
+from typing import Callable, Iterable, Iterator
+
+from sqlalchemy import Select, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .crud import MOVEMENT_FIELDS, PRODUCT_FIELDS
+from .models import Product, StockMovement
+from .snapshots import naive_utc
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))  # Filas por bloque leído/enviado
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+def products_query() -> Select:
+    # Todos los productos ordenados por ID
+    return select(*(getattr(Product, f) for f in PRODUCT_FIELDS)).order_by(Product.id)
+
+def movements_query(product_id: int | None = None, since: datetime | None = None, until: datetime | None = None) -> Select:
+    # Movimientos en orden cronológico, filtrados por producto y rango [since, until) (created_at es UTC sin zona)
+    q = select(*(getattr(StockMovement, f) for f in MOVEMENT_FIELDS)).order_by(StockMovement.created_at, StockMovement.id)
+    if product_id:
+        q = q.where(StockMovement.product_id == product_id)
+    if since:
+        q = q.where(StockMovement.created_at >= naive_utc(since))
+    if until:
+        q = q.where(StockMovement.created_at < naive_utc(until))
+    return q
+
+def _csv_value(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+def _json_default(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(v).__name__}")
+
+def encode_csv(columns: tuple[str, ...], rows: Iterable[tuple]) -> Iterator[str]:
+    """Serializa filas a CSV con cabecera, en bloques de EXPORT_BATCH_SIZE filas"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(v) for v in row])
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+def encode_ndjson(columns: tuple[str, ...], rows: Iterable[tuple]) -> Iterator[str]:
+    """Serializa filas a NDJSON (un objeto JSON por línea), en bloques de EXPORT_BATCH_SIZE filas"""
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False))
+        if len(chunk) == EXPORT_BATCH_SIZE:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+ENCODERS: dict[str, Callable[[tuple[str, ...], Iterable[tuple]], Iterator[str]]] = {
+    "csv": encode_csv,
+    "ndjson": encode_ndjson,
+}
+
+def stream_rows(db: Session, query: Select) -> Iterator[tuple]:
+    """Recorre el resultado con un cursor del lado del servidor, EXPORT_BATCH_SIZE filas cada vez"""
+    result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    for partition in result.partitions():
+        yield from partition
+
+def movement_order(row) -> tuple:
+    # Orden de movements_query: (created_at, id)
+    return row[7], row[0]
+
+def stream_export(
+    bind: Engine | Connection,
+    query: Select,
+    columns: tuple[str, ...],
+    fmt: str,
+    archived: Iterable[tuple] | None = None,
+    order: Callable[[tuple], tuple] = movement_order,
+) -> Iterator[str]:
+    """
+    Generador para StreamingResponse. Abre su propia sesión sobre `bind`
+    porque la sesión de la petición se cierra antes de empezar a enviar el cuerpo.
+    archived: filas ya ordenadas según `order` (p. ej. de los ficheros archivados) que se intercalan con las de query.
+    """
+    with Session(bind=bind) as db:
+        rows = stream_rows(db, query)
+        if archived is not None:
+            rows = heapq.merge(archived, rows, key=order)
+        yield from ENCODERS[fmt](columns, rows)
@@ -0,0 +1,76 @@
+"""
+Pool dedicado y acotado para el hashing de contraseñas (bcrypt).
+Evita que un pico de logins consuma el event loop o el threadpool de Starlette:
+como mucho PASSWORD_HASH_QUEUE operaciones pendientes; por encima se rechaza (429) en lugar de encolar sin límite.
+"""
+
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # Coste de bcrypt; al cambiarlo los hashes se rehacen en el login
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0 = en el propio event loop
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))  # Máximo de operaciones en curso + en espera
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")  # thread (bcrypt libera el GIL) o process
+
+# min/max = rounds: needs_update marca cualquier hash con otro coste, tanto menor como mayor
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+class HashingPoolSaturated(Exception):
+    """Hay demasiadas operaciones de hashing pendientes"""
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(plain: str, hashed: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(plain, hashed)
+
+class HashingPool:
+    def __init__(self, workers: int, queue_size: int, kind: str = "thread"):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.kind = kind
+        self.pending = 0
+        self._executor: Executor | None = None
+
+    def _get_executor(self) -> Executor:
+        # Se crea al primer uso para no lanzar hilos/procesos al importar
+        if self._executor is None:
+            cls = ProcessPoolExecutor if self.kind == "process" else ThreadPoolExecutor
+            self._executor = cls(max_workers=self.workers)
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Ejecuta fn en el pool; lanza HashingPoolSaturated si ya hay queue_size operaciones pendientes"""
+        if self.workers <= 0:
+            return fn(*args)
+        if self.pending >= self.queue_size:
+            raise HashingPoolSaturated()
+        self.pending += 1  # Solo se modifica desde el event loop
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+hashing_pool = HashingPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE, PASSWORD_HASH_EXECUTOR)
+
+async def hash_password_async(password: str) -> str:
+    """Genera el hash bcrypt en el pool dedicado"""
+    return await hashing_pool.run(_hash, password)
+
+async def verify_password_async(plain: str, hashed: str) -> tuple[bool, str | None]:
+    """Verifica la contraseña en el pool dedicado; devuelve (válida, nuevo hash si hay que rehacerlo)"""
+    return await hashing_pool.run(_verify_and_update, plain, hashed)
@@ -0,0 +1,148 @@
+"""
+GET condicionales y caché de respuestas para los listados de lectura.
+La versión de los datos es una marca de agua leída de la base de datos (último updated_at de productos
+y último ID de movimiento), así que es correcta aunque escriban otros workers. Con ella se calcula un ETag
+débil por URL (el mismo para el cuerpo sin comprimir, gzip o Brotli): If-None-Match coincidente → 304 sin
+consultar ni serializar, y si no, el cuerpo ya serializado sale de una caché en memoria mientras la versión no cambie.
+Incluye también la compresión (gzip, o Brotli si brotli-asgi está instalado) de respuestas grandes,
+con Vary: Accept-Encoding para que las cachés intermedias no sirvan una codificación a quien pidió otra.
+"""
+
+import hashlib
+import os
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .cache import TTLCache
+from .models import Product, StockMovement
+
+try:  # Dependencia opcional
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))  # Respuestas serializadas en memoria
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))  # Segundos (la versión ya invalida antes)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # Bytes a partir de los que se comprime
+
+_responses = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)  # URL -> CachedBody
+
+# ------- Versión de los datos -------
+def version_stmt() -> Select:
+    # Ambos máximos salen de índices (products.updated_at y la clave primaria de stock_movements)
+    return select(
+        select(func.max(Product.updated_at)).scalar_subquery(),
+        select(func.max(StockMovement.id)).scalar_subquery(),
+    )
+
+def _format_version(updated_at, movement_id) -> str:
+    return f"{updated_at.isoformat() if updated_at else '-'}/{movement_id or 0}"
+
+def data_version(db: Session) -> str:
+    return _format_version(*db.execute(version_stmt()).one())
+
+async def data_version_async(db: AsyncSession) -> str:
+    return _format_version(*(await db.execute(version_stmt())).one())
+
+def invalidate_responses() -> None:
+    """Vacía la caché de respuestas de este worker (se llama desde las escrituras de crud)"""
+    _responses.clear()
+
+# ------- ETag y caché -------
+@dataclass
+class CachedBody:
+    etag: str
+    body: bytes
+    headers: dict[str, str]
+
+def cache_key(request: Request) -> str:
+    # Path + parámetros ordenados: el mismo listado pedido con otro orden de parámetros comparte entrada
+    return f"{request.url.path}?{urlencode(sorted(request.query_params.multi_items()))}"
+
+def etag_for(key: str, version: str) -> str:
+    # Débil: identifica los datos, no los bytes (la compresión cambia el cuerpo pero no el ETag)
+    return 'W/"' + hashlib.blake2b(f"{key}|{version}".encode(), digest_size=16).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match usa comparación débil: se ignora el prefijo W/ de ambos lados
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+@dataclass
+class Conditional:
+    """Resultado de comprobar un GET condicional: response ya lista (304 o caché) o store() para guardar la nueva"""
+    key: str
+    etag: str
+    response: Response | None = None
+
+    @property
+    def headers(self) -> dict[str, str]:
+        # no-cache: el cliente puede guardar la respuesta pero debe revalidarla siempre con el ETag
+        return {"ETag": self.etag, "Cache-Control": "no-cache"}
+
+    def store(self, body: bytes, headers: dict[str, str] | None = None) -> Response:
+        entry = CachedBody(self.etag, body, headers or {})
+        _responses.set(self.key, entry)
+        return self._send(entry)
+
+    def _send(self, entry: CachedBody) -> Response:
+        return Response(entry.body, media_type="application/json", headers={**entry.headers, **self.headers})
+
+def conditional(request: Request, version: str) -> Conditional:
+    """
+    Comprueba If-None-Match y la caché para la URL pedida con la versión actual de los datos.
+    Si Conditional.response es None hay que generar el cuerpo y guardarlo con store().
+    """
+    key = cache_key(request)
+    cond = Conditional(key, etag_for(key, version))
+    if etag_matches(request, cond.etag):
+        cond.response = Response(status_code=304, headers=cond.headers)
+        return cond
+    entry = _responses.get(key)
+    if entry is not None and entry.etag == cond.etag:
+        cond.response = cond._send(entry)
+    return cond
+
+# ------- Compresión -------
+class CompressionMiddleware:
+    """
+    Comprime las respuestas a partir de COMPRESSION_MIN_SIZE bytes: Brotli si brotli-asgi está instalado
+    (con gzip para clientes que no lo aceptan) o gzip. Los streams SSE nunca se comprimen:
+    el compresor retendría los eventos en su buffer.
+    Todas las respuestas que pasan por el compresor llevan Vary: Accept-Encoding, también las que salen
+    sin comprimir (pequeñas, 304 o clientes sin gzip): su cuerpo depende igualmente de esa cabecera.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE, excluded_paths: tuple[str, ...] = ("/api/events",)):
+        self.app = app
+        self.excluded_paths = excluded_paths
+        if BrotliMiddleware is not None:
+            self.compressed = BrotliMiddleware(app, minimum_size=minimum_size, gzip_fallback=True)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.excluded_paths):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_vary(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                vary = {v.strip().lower() for v in headers.get("vary", "").split(",")}
+                if "accept-encoding" not in vary:
+                    headers.add_vary_header("Accept-Encoding")
+            await send(message)
+
+        await self.compressed(scope, receive, send_with_vary)
@@ -0,0 +1,180 @@
+"""
+Claves de idempotencia para el registro de movimientos.
+Los lectores reintentan POST /api/movements cuando la red falla y la respuesta no llega: con la cabecera
+Idempotency-Key (o idempotency_key en cada línea de /api/movements/bulk) el reintento devuelve el movimiento
+original en lugar de aplicar el delta otra vez. La clave se reserva en la misma transacción que el movimiento
+con un INSERT ... ON CONFLICT sobre la clave primaria de idempotency_keys; si ya existía, una lectura por esa
+misma clave devuelve el ID del movimiento. Las claves se olvidan pasado IDEMPOTENCY_TTL.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import IdempotencyKey, StockMovement
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # Segundos que se recuerda una clave
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))  # Segundos entre purgas de claves caducadas (0 = desactivado)
+
+INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+MOVEMENT_COLUMNS = ("id", "product_id", "delta", "qty_before", "qty_after", "reason", "type", "created_at")
+
+logger = logging.getLogger(__name__)
+
+class IdempotencyError(Exception):
+    """Clave de idempotencia que no se puede aplicar a la petición"""
+    status_code = 422
+
+class IdempotencyMismatch(IdempotencyError):
+    """La clave ya se usó con otro contenido"""
+
+class IdempotencyPending(IdempotencyError):
+    """La petición original con esta clave aún no ha terminado"""
+    status_code = 409
+
+class IdempotencyGone(IdempotencyError):
+    """La clave ya se usó, pero su movimiento ya no existe (archivado o borrado): no se puede repetir ni volver a aplicar"""
+    status_code = 410
+
+def _gone(key: str) -> IdempotencyGone:
+    return IdempotencyGone(f"La clave de idempotencia {key} ya se usó y su movimiento ya no está disponible")
+
+def request_hash(product_id: int | str, delta: int, reason: str | None) -> str:
+    # Huella de la petición (con el ID de producto o el código escaneado): misma clave con otro contenido = error del cliente
+    body = json.dumps([product_id, delta, reason], ensure_ascii=False)
+    return hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+
+def claim_keys(db: Session, hashes: dict[str, str]) -> dict[str, int]:
+    """
+    Reserva las claves (clave -> huella de la petición) en la transacción en curso.
+    Devuelve las que ya estaban en uso con el ID de su movimiento; el resto queda reservado hasta el commit
+    (una clave caducada se reutiliza). Con PostgreSQL, un reintento concurrente espera en el índice único
+    a que termine la transacción original y después lee su movimiento.
+    """
+    if not hashes:
+        return {}
+    dialect = db.get_bind().dialect.name
+    if dialect not in INSERTS:
+        raise RuntimeError(f"Claves de idempotencia no disponibles en {dialect}")
+    now = datetime.utcnow()
+    stmt = INSERTS[dialect](IdempotencyKey).values([
+        {"key": key, "request_hash": h, "created_at": now, "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL)}
+        for key, h in hashes.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.key],
+        set_={
+            "request_hash": stmt.excluded.request_hash,
+            "movement_id": None,
+            "created_at": stmt.excluded.created_at,
+            "expires_at": stmt.excluded.expires_at,
+        },
+        where=IdempotencyKey.expires_at <= now,
+    ).returning(IdempotencyKey.key)
+    used = set(hashes) - set(db.execute(stmt).scalars())
+    if not used:
+        return {}
+
+    originals = {}
+    rows = db.execute(
+        select(IdempotencyKey.key, IdempotencyKey.request_hash, IdempotencyKey.movement_id)
+        .where(IdempotencyKey.key.in_(used))
+    ).all()
+    for key, h, movement_id in rows:
+        if h != hashes[key]:
+            raise IdempotencyMismatch(f"La clave de idempotencia {key} ya se usó con otra petición")
+        if movement_id is None:
+            raise IdempotencyPending(f"La petición con clave de idempotencia {key} aún está en curso")
+        originals[key] = movement_id
+    return originals
+
+def bind_keys(db: Session, movement_ids: dict[str, int]) -> None:
+    # Asocia cada clave reservada al movimiento creado (antes del commit de ese movimiento)
+    if movement_ids:
+        db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key.in_(movement_ids))
+            .values(movement_id=case(movement_ids, value=IdempotencyKey.key))
+            .execution_options(synchronize_session=False)
+        )
+
+def replay_movement(db: Session, key: str, product_id: int | str, delta: int, reason: str | None) -> StockMovement | None:
+    """
+    Reserva la clave de un movimiento individual. None si es nueva (hay que registrar el movimiento
+    con crud.record_movement(..., idempotency_key=key)); si ya se usó, el movimiento original
+    (IdempotencyGone si ya no existe: nunca se vuelve a aplicar).
+    """
+    original = claim_keys(db, {key: request_hash(product_id, delta, reason)})
+    if not original:
+        return None
+    movement = db.get(StockMovement, original[key])
+    if movement is None:
+        raise _gone(key)
+    return movement
+
+def replayed_lines(db: Session, items: list[tuple[int, int, str | None]], keys: list[str | None]) -> dict[int, dict]:
+    """
+    Reserva las claves de las líneas de un lote y devuelve {índice de línea: movimiento original}
+    para las que ya se habían registrado. Las líneas sin clave o con clave nueva se aplican normalmente.
+    Si el movimiento original de alguna ya no existe, IdempotencyGone para todo el lote.
+    """
+    hashes: dict[str, str] = {}
+    for item, key in zip(items, keys):
+        if key is None:
+            continue
+        if key in hashes:
+            raise IdempotencyMismatch(f"La clave de idempotencia {key} está repetida en el lote")
+        hashes[key] = request_hash(*item)
+    originals = claim_keys(db, hashes)
+    if not originals:
+        return {}
+    columns = [getattr(StockMovement, c) for c in MOVEMENT_COLUMNS]
+    rows = {
+        row["id"]: dict(row)
+        for row in db.execute(select(*columns).where(StockMovement.id.in_(originals.values()))).mappings()
+    }
+    for key, movement_id in originals.items():
+        if movement_id not in rows:
+            raise _gone(key)
+    return {i: rows[originals[key]] for i, key in enumerate(keys) if key in originals}
+
+def merge_lines(total: int, applied: list[int], rows: list[dict], replayed: dict[int, dict]) -> list[dict]:
+    # Respuesta del lote en el orden de llegada: movimientos nuevos y originales de las líneas repetidas
+    result: list[dict | None] = [None] * total
+    for i, row in zip(applied, rows):
+        result[i] = row
+    for i, row in replayed.items():
+        result[i] = row
+    return [row for row in result if row is not None]
+
+def purge_expired(db: Session, batch_size: int = 10000) -> int:
+    """Elimina claves caducadas (como mucho batch_size) y devuelve cuántas"""
+    due = select(IdempotencyKey.key).where(IdempotencyKey.expires_at <= datetime.utcnow()).limit(batch_size)
+    deleted = db.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.key.in_(due)).execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return deleted
+
+async def purge_loop(session_factory, interval: float = IDEMPOTENCY_PURGE_INTERVAL):
+    """Purga periódica de claves de idempotencia caducadas (tarea del lifespan de la aplicación)"""
+    def run_once():
+        with session_factory() as db:
+            while purge_expired(db):
+                pass
+
+    while True:
+        try:
+            await run_in_threadpool(run_once)
+        except Exception:
+            logger.exception("Error al purgar las claves de idempotencia caducadas")
+        await asyncio.sleep(interval)
@@ -0,0 +1,9 @@
+"""
+Punto de entrada de la importación masiva de productos: python -m app.import catalogo.csv
+(la lógica está en importer.py, porque "import" no es un nombre importable desde código).
+"""
+
+from .importer import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Importación masiva del catálogo de productos desde CSV o NDJSON.
+Lee el fichero en streaming, valida cada fila con ProductCreate (mismas reglas de EAN13 que la API)
+y hace upsert por SKU en lotes grandes con INSERT ... ON CONFLICT (PostgreSQL o SQLite).
+Los errores se reportan por fila sin abortar el lote.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import BinaryIO, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import barcodes
+from .crud import get_product_by_sku
+from .http_cache import invalidate_responses
+from .models import Product
+from .schemas import ImportReport, ImportRowError, ProductCreate
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))  # Filas por INSERT ... ON CONFLICT
+
+logger = logging.getLogger(__name__)
+
+def detect_format(filename: str | None, content_type: str | None = None) -> str:
+    """Deduce el formato (csv o ndjson) a partir del nombre o el content-type del fichero"""
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or ""):
+        return "ndjson"
+    return "csv"
+
+def read_rows(stream: BinaryIO, fmt: str) -> Iterator[tuple[int, dict | None, str | None]]:
+    """
+    Recorre el fichero fila a fila sin cargarlo entero en memoria.
+    Devuelve (línea, datos, error de lectura); las celdas vacías se omiten para usar los valores por defecto.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "ndjson":
+        for lineno, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield lineno, None, f"JSON inválido: {e}"
+                continue
+            if not isinstance(data, dict):
+                yield lineno, None, "Se esperaba un objeto JSON"
+                continue
+            yield lineno, data, None
+    else:
+        reader = csv.DictReader(text)
+        for data in reader:
+            yield reader.line_num, {k: v for k, v in data.items() if k and v not in (None, "")}, None
+
+def _format_error(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors(include_url=False))
+
+def _upsert_batch(db: Session, rows: list[dict]) -> None:
+    """
+    Inserta o actualiza un lote por SKU. En un conflicto se actualizan EAN13 y nombre;
+    el stock solo se fija al crear el producto (después cambia mediante movimientos).
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(Product)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Product.sku],
+            set_={"ean13": stmt.excluded.ean13, "name": stmt.excluded.name, "updated_at": stmt.excluded.updated_at},
+        )
+        db.execute(stmt, rows)
+        return
+    # Otros motores: upsert fila a fila
+    for row in rows:
+        product = get_product_by_sku(db, row["sku"])
+        if product is None:
+            db.add(Product(**row))
+        else:
+            product.ean13, product.name, product.updated_at = row["ean13"], row["name"], row["updated_at"]
+    db.flush()
+
+def _flush(db: Session, batch: list[tuple[int, dict]], errors: list[ImportRowError]) -> int:
+    """
+    Guarda un lote y devuelve cuántas filas del fichero se aplicaron (un SKU repetido cuenta cada vez,
+    tanto en el INSERT del lote como fila a fila).
+    Si el lote choca con una restricción (p. ej. un EAN13 ya usado por otro SKU) se repite fila a fila
+    en savepoints para aislar las filas erróneas.
+    """
+    # Un SKU repetido dentro del lote no puede ir en el mismo INSERT ... ON CONFLICT: gana la última fila
+    rows = list({row["sku"]: row for _, row in batch}.values())
+    # El upsert puede cambiar el EAN13 de un SKU: sus códigos se vuelven a resolver en el próximo escaneo
+    barcodes.forget(*(code for row in rows for code in (row["sku"], row["ean13"])))
+    try:
+        _upsert_batch(db, rows)
+        db.commit()
+        return len(batch)
+    except IntegrityError:
+        db.rollback()
+
+    applied = 0
+    for lineno, row in batch:
+        try:
+            with db.begin_nested():
+                _upsert_batch(db, [row])
+            applied += 1
+        except IntegrityError as e:
+            errors.append(ImportRowError(line=lineno, sku=row["sku"], error=str(e.orig).splitlines()[0]))
+    db.commit()
+    return applied
+
+def import_products(db: Session, stream: BinaryIO, fmt: str = "csv", batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """
+    Importa productos desde un fichero CSV (cabecera sku,ean13,name[,stock_qty]) o NDJSON.
+    Cada lote se confirma por separado; devuelve el resumen con los errores por fila.
+    """
+    start = time.perf_counter()
+    processed = upserted = 0
+    errors: list[ImportRowError] = []
+    batch: list[tuple[int, dict]] = []
+
+    for lineno, data, read_error in read_rows(stream, fmt):
+        processed += 1
+        if read_error:
+            errors.append(ImportRowError(line=lineno, error=read_error))
+            continue
+        try:
+            item = ProductCreate.model_validate(data)
+        except ValidationError as e:
+            errors.append(ImportRowError(line=lineno, sku=data.get("sku"), error=_format_error(e)))
+            continue
+        now = datetime.utcnow()
+        batch.append((lineno, {**item.model_dump(), "created_at": now, "updated_at": now}))
+        if len(batch) >= batch_size:
+            upserted += _flush(db, batch, errors)
+            batch = []
+            elapsed = time.perf_counter() - start
+            logger.info("Importadas %d filas (%.0f filas/s)", processed, processed / elapsed)
+    if batch:
+        upserted += _flush(db, batch, errors)
+    invalidate_responses()
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    logger.info("Importación terminada: %d filas, %d aplicadas, %d errores en %.2fs (%.0f filas/s)",
+                processed, upserted, len(errors), elapsed, rate)
+    return ImportReport(
+        processed=processed,
+        upserted=upserted,
+        errors=errors,
+        elapsed_seconds=round(elapsed, 3),
+        rows_per_second=round(rate, 1),
+    )
+
+def main(argv: list[str] | None = None):
+    """CLI: python -m app.import fichero.csv [--format ndjson] [--batch-size N]"""
+    import argparse
+
+    from .database import SessionLocal, get_engine
+    from .migrations import migrate
+
+    parser = argparse.ArgumentParser(prog="python -m app.import", description="Importa el catálogo de productos (CSV o NDJSON)")
+    parser.add_argument("path", help="Fichero CSV o NDJSON")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Por defecto se deduce de la extensión")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    migrate(get_engine())
+    db = SessionLocal()
+    try:
+        with open(args.path, "rb") as f:
+            report = import_products(db, f, args.format or detect_format(args.path), args.batch_size)
+    finally:
+        db.close()
+    for err in report.errors:
+        print(f"Línea {err.line} ({err.sku or '-'}): {err.error}")
+    print(f"Importación completada: {report.upserted}/{report.processed} filas en {report.elapsed_seconds}s "
+          f"({report.rows_per_second} filas/s), {len(report.errors)} errores.")
@@ -0,0 +1,209 @@
+"""
+Instrumentación de consultas SQL por petición.
+Los eventos del motor (before/after_cursor_execute) acumulan en la petición en curso el número de consultas,
+el tiempo total en la base de datos y la consulta más lenta; el middleware lo devuelve en la cabecera
+Server-Timing y lo agrega en métricas de proceso que se exponen en formato Prometheus (/metrics).
+Las consultas que superan SLOW_QUERY_MS se registran en el log. El coste por consulta es un par de
+perf_counter() y un lock, así que se puede dejar activado en producción (INSTRUMENTATION=false lo quita).
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "true").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))  # Umbral del log de consultas lentas
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class RequestStats:
+    scope: dict | None = None
+    queries: int = 0
+    db_seconds: float = 0.0
+    slowest_seconds: float = 0.0
+    slowest_sql: str | None = None
+
+    def server_timing(self, total_seconds: float) -> str:
+        # Cabecera Server-Timing (duraciones en milisegundos)
+        return (
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.queries} queries", '
+            f"db-slowest;dur={self.slowest_seconds * 1000:.2f}, "
+            f"total;dur={total_seconds * 1000:.2f}"
+        )
+
+_current: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("request_stats", default=None)
+
+def current_stats() -> RequestStats | None:
+    """Estadísticas de la petición en curso (None fuera de una petición)"""
+    return _current.get()
+
+# ------- Métricas de proceso -------
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...]
+    counts: list[int] = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self):
+        self.counts = [0] * len(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name: str, labels: str = "") -> list[str]:
+        sep = "," if labels else ""
+        out, acc = [], 0
+        for bound, n in zip(self.buckets, self.counts):
+            acc += n
+            out.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {acc}')
+        out.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        out.append(f"{name}_sum{suffix} {self.total:.6f}")
+        out.append(f"{name}_count{suffix} {self.count}")
+        return out
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """Contadores e histogramas del proceso (cada worker expone los suyos)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests: dict[tuple[str, str, int], int] = defaultdict(int)
+            self.request_seconds: dict[tuple[str, str], Histogram] = {}
+            self.route_queries: dict[tuple[str, str], int] = defaultdict(int)
+            self.route_db_seconds: dict[tuple[str, str], float] = defaultdict(float)
+            self.query_seconds = Histogram(QUERY_BUCKETS)
+            self.slow_queries = 0
+
+    def observe_query(self, seconds: float, slow: bool) -> None:
+        with self._lock:
+            self.query_seconds.observe(seconds)
+            if slow:
+                self.slow_queries += 1
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            hist = self.request_seconds.get(key)
+            if hist is None:
+                hist = self.request_seconds[key] = Histogram(REQUEST_BUCKETS)
+            hist.observe(seconds)
+            self.route_queries[key] += stats.queries
+            self.route_db_seconds[key] += stats.db_seconds
+
+    def render(self, gauges: dict[str, float] | None = None) -> str:
+        """Texto en formato de exposición de Prometheus"""
+        lines = []
+        with self._lock:
+            lines += ["# HELP http_requests_total Peticiones HTTP atendidas", "# TYPE http_requests_total counter"]
+            for (method, route, status), n in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{_label(route)}",status="{status}"}} {n}')
+            lines += ["# HELP http_request_duration_seconds Duración de las peticiones", "# TYPE http_request_duration_seconds histogram"]
+            for (method, route), hist in sorted(self.request_seconds.items()):
+                lines += hist.lines("http_request_duration_seconds", f'method="{method}",route="{_label(route)}"')
+            lines += ["# HELP db_queries_total Consultas SQL por ruta", "# TYPE db_queries_total counter"]
+            for (method, route), n in sorted(self.route_queries.items()):
+                lines.append(f'db_queries_total{{method="{method}",route="{_label(route)}"}} {n}')
+            lines += ["# HELP db_time_seconds_total Tiempo en la base de datos por ruta", "# TYPE db_time_seconds_total counter"]
+            for (method, route), s in sorted(self.route_db_seconds.items()):
+                lines.append(f'db_time_seconds_total{{method="{method}",route="{_label(route)}"}} {s:.6f}')
+            lines += ["# HELP db_query_duration_seconds Duración de cada consulta SQL", "# TYPE db_query_duration_seconds histogram"]
+            lines += self.query_seconds.lines("db_query_duration_seconds")
+            lines += ["# HELP db_slow_queries_total Consultas por encima de SLOW_QUERY_MS", "# TYPE db_slow_queries_total counter",
+                      f"db_slow_queries_total {self.slow_queries}"]
+        typed = set()
+        for series, value in (gauges or {}).items():
+            name = series.split("{", 1)[0]
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{series} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# ------- Eventos del motor -------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if elapsed > stats.slowest_seconds:
+            stats.slowest_seconds = elapsed
+            stats.slowest_sql = statement
+    metrics.observe_query(elapsed, slow)
+    if slow:
+        route = route_name(stats.scope) if stats is not None and stats.scope else "-"
+        logger.warning("Consulta lenta (%.1f ms, %s): %s", elapsed * 1000, route, " ".join(statement.split())[:2000])
+
+def instrument_engine(engine):
+    """Engancha los eventos de instrumentación a un Engine o AsyncEngine (se llama desde database.py)"""
+    if INSTRUMENTATION:
+        sync_engine = getattr(engine, "sync_engine", engine)
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+# ------- Middleware -------
+def route_name(scope: dict) -> str:
+    # Plantilla de la ruta (/api/products/{product_id}/stock) para no crear una serie por cada URL
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class InstrumentationMiddleware:
+    """Mide cada petición HTTP, añade Server-Timing y la registra en las métricas del proceso"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not INSTRUMENTATION:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(scope=scope)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = stats.server_timing(time.perf_counter() - start).encode()
+                message["headers"] = [*message.get("headers", []), (b"server-timing", timing)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            metrics.observe_request(scope["method"], route_name(scope), status, time.perf_counter() - start, stats)
@@ -1,76 +1,315 @@
 """
 Define la API de inventario: rutas para productos y movimientos, gestión de stock y autenticación.
 Incluye endpoints para listar, crear y ajustar productos, así como para registrar y consultar movimientos.
+create_app() construye la aplicación sin tocar la base de datos: los motores se crean en el primer uso
+y el esquema se aplica aparte con python -m app.migrations.
 """
 
+import asyncio
 import os
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from typing import Literal
+
+from fastapi import APIRouter, FastAPI, Depends, File, Header, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
-from .database import Base, engine, get_db
-from .models import Product
-from .schemas import ProductOut, MovementCreate, MovementOut, StockAdjust, ProductCreate
-from .crud import list_products, get_product, record_movement, set_stock, create_product, list_movements
-from .auth import router as auth_router
-from .deps import RequireAuth
+from .database import (
+    DB_ASYNC, ReadYourWritesMiddleware, SessionLocal, dispose_engines, get_async_engine, get_async_read_engines,
+    get_db, get_engine, get_read_db, get_read_engines,
+)
+from .events import router as events_router, start_listener
+from .http_cache import CompressionMiddleware, conditional, data_version
+from .instrumentation import InstrumentationMiddleware, metrics
+from .pool import pool_stats
+from .schemas import ProductOut, MovementCreate, MovementOut, StockAdjust, ProductCreate, ImportReport, StockAt, Availability
+from .crud import PRODUCT_FIELDS, InsufficientStock, list_products, get_product, record_movement, record_movements_bulk, set_stock, create_product, list_movements
+from .auth import router as auth_router, async_router as async_auth_router
+from .async_api import router as async_inventory
+from .deps import (
+    FAST_SERIALIZATION, RequireAuth, MovementListParams, ProductListParams, movement_batch, movement_list_params,
+    movements_page, product_list_params, products_page,
+)
+from .archive import archived_movements
+from .idempotency import IDEMPOTENCY_PURGE_INTERVAL, IdempotencyError, purge_loop, replay_movement
+from .barcodes import SCAN_INDEX_SIZE, warm_in_background
+from .importer import detect_format, import_products
+from .export import MEDIA_TYPES, MOVEMENT_FIELDS, products_query, movements_query, stream_export
+from .partitions import MOVEMENTS_PARTITIONED, partition_loop
+from .reports import router as reports_router
+from .reservations import RESERVATION_SWEEP_INTERVAL, availability, expiry_loop, router as reservations_router
+from .scan import router as scan_router
+from .snapshots import SNAPSHOT_INTERVAL, ArchivedPeriodError, naive_utc, rollup_loop, stock_at
 
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173")
 
-# Crear tablas al iniciar la aplicación (para mayor simplicidad en las pruebas)
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Inventory API", version="0.1.0")
-
-# Configura CORS para permitir peticiones desde el frontend definido en CORS_ORIGINS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[o.strip() for o in CORS_ORIGINS.split(",")],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Las tareas en segundo plano se conectan al ejecutarse: el arranque no espera a la base de datos
+    engine = get_engine()
+    # Rollup periódico de los snapshots de stock en segundo plano (SNAPSHOT_INTERVAL=0 lo desactiva)
+    tasks = [asyncio.create_task(rollup_loop(SessionLocal))] if SNAPSHOT_INTERVAL > 0 else []
+    # Barrido de reservas caducadas (RESERVATION_SWEEP_INTERVAL=0 lo desactiva)
+    if RESERVATION_SWEEP_INTERVAL > 0:
+        tasks.append(asyncio.create_task(expiry_loop(SessionLocal)))
+    # Purga de claves de idempotencia caducadas (IDEMPOTENCY_PURGE_INTERVAL=0 la desactiva)
+    if IDEMPOTENCY_PURGE_INTERVAL > 0:
+        tasks.append(asyncio.create_task(purge_loop(SessionLocal)))
+    # Particiones mensuales de stock_movements de los próximos meses (MOVEMENTS_PARTITIONED=true, PostgreSQL)
+    if MOVEMENTS_PARTITIONED and engine.dialect.name == "postgresql":
+        tasks.append(asyncio.create_task(partition_loop(engine)))
+    # Precarga del índice de códigos de POST /api/scan (SCAN_INDEX_SIZE=0 lo desactiva)
+    if SCAN_INDEX_SIZE > 0:
+        tasks.append(asyncio.create_task(warm_in_background(SessionLocal)))
+    # LISTEN de los movimientos de otros workers (EVENTS_PG_NOTIFY=true con PostgreSQL)
+    listener = start_listener(engine)
+    yield
+    if listener is not None:
+        listener.stop()
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await dispose_engines()
 
-# Incluye el router de autenticación
-app.include_router(auth_router)
+# Rutas comunes a los modos síncrono y asíncrono (salud, métricas, importación, exportación...)
+router = APIRouter()
 
-@app.get("/health")
+@router.get("/health")
 def health():
     # Endpoint de salud para comprobar que la API está funcionando
     return {"status": "ok"}
 
+@router.get("/health/pool")
+def health_pool():
+    # Estadísticas del pool de conexiones de este worker (en uso, overflow, esperas)
+    stats = {"sync": pool_stats(get_engine().pool)}
+    if get_async_engine() is not None:
+        stats["async"] = pool_stats(get_async_engine().pool)
+    for i, eng in enumerate(get_read_engines()):
+        stats[f"read{i}"] = pool_stats(eng.pool)
+    for i, eng in enumerate(get_async_read_engines()):
+        stats[f"async_read{i}"] = pool_stats(eng.pool)
+    return stats
+
+def _pool_gauges() -> dict[str, float]:
+    # Valores numéricos de pool_stats como gauges (db_pool_checked_out{engine="sync"}, ...)
+    engines = {"sync": get_engine(), "async": get_async_engine()}
+    engines.update({f"read{i}": eng for i, eng in enumerate(get_read_engines())})
+    engines.update({f"async_read{i}": eng for i, eng in enumerate(get_async_read_engines())})
+    gauges = {}
+    for name, eng in engines.items():
+        if eng is None:
+            continue
+        for key, value in pool_stats(eng.pool).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges[f'db_pool_{key}{{engine="{name}"}}'] = value
+    return gauges
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def api_metrics():
+    # Métricas de este worker en formato Prometheus (peticiones, consultas SQL, consultas lentas, pool)
+    return PlainTextResponse(metrics.render(_pool_gauges()), media_type="text/plain; version=0.0.4")
+
 # ------- Productos -------
-@app.get("/api/products", response_model=list[ProductOut], tags=["inventory"])
-def api_list_products(db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
-    # Lista todos los productos disponibles
-    return list_products(db)
+# Rutas principales del inventario; con DB_ASYNC=true se sirven las equivalentes de async_api
+inventory = APIRouter(tags=["inventory"])
 
-@app.post("/api/products", response_model=ProductOut, tags=["inventory"])
+@inventory.get("/api/products", response_model=list[ProductOut])
+def api_list_products(
+    request: Request,
+    params: ProductListParams = Depends(product_list_params),
+    db: Session = Depends(get_read_db),
+    _auth=Depends(RequireAuth),
+):
+    # Lista productos paginados por ID con filtros opcionales (prefijo de SKU, nombre, stock bajo, actualizados desde).
+    # Con fields= solo se consultan y devuelven esas columnas (el ID siempre se incluye).
+    # ETag según la versión de los datos: If-None-Match → 304; si no ha cambiado nada, respuesta desde la caché.
+    cond = conditional(request, data_version(db))
+    if cond.response is not None:
+        return cond.response
+    return cond.store(*products_page(list_products(db, **params.filters()), params))
+
+@inventory.post("/api/products", response_model=ProductOut)
 def api_create_product(payload: ProductCreate, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
     # Crea un nuevo producto con SKU, EAN13, nombre y stock inicial
     return create_product(db, sku=payload.sku, ean13=payload.ean13, name=payload.name, stock_qty=payload.stock_qty)
 
-@app.patch("/api/products/{product_id}/stock", response_model=MovementOut, tags=["inventory"])
+@inventory.patch("/api/products/{product_id}/stock", response_model=MovementOut)
 def api_adjust_stock(product_id: int, payload: StockAdjust, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
     # Ajusta la cantidad de stock de un producto y registra el movimiento
     product = get_product(db, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
-    movement = set_stock(db, product, quantity=payload.quantity, reason=payload.reason)
-    return movement
+    try:
+        return set_stock(db, product, quantity=payload.quantity, reason=payload.reason)
+    except InsufficientStock:
+        raise HTTPException(status_code=409, detail="La cantidad es menor que el stock reservado")
 
 # ------- Movimientos -------
-@app.post("/api/movements", response_model=MovementOut, tags=["inventory"])
-def api_create_movement(payload: MovementCreate, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
-    # Registra un movimiento de stock (entrada o salida) para un producto
+@inventory.post("/api/movements", response_model=MovementOut)
+def api_create_movement(
+    payload: MovementCreate,
+    response: Response,
+    idempotency_key: str | None = Header(None, min_length=1, max_length=255),
+    db: Session = Depends(get_db),
+    _auth=Depends(RequireAuth),
+):
+    # Registra un movimiento de stock (entrada o salida) para un producto.
+    # Con Idempotency-Key, un reintento devuelve el movimiento original sin volver a tocar el stock.
+    key = idempotency_key or payload.idempotency_key
+    if key:
+        try:
+            original = replay_movement(db, key, payload.product_id, payload.delta, payload.reason)
+        except IdempotencyError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        if original is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return original
     product = get_product(db, payload.product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     mtype = "IN" if payload.delta >= 0 else "OUT"
-    movement = record_movement(db, product, delta=payload.delta, reason=payload.reason, mtype=mtype)
-    return movement
+    try:
+        return record_movement(db, product, delta=payload.delta, reason=payload.reason, mtype=mtype, idempotency_key=key)
+    except InsufficientStock:
+        raise HTTPException(status_code=409, detail="Stock disponible insuficiente")
+
+@inventory.post("/api/movements/bulk", response_model=list[MovementOut])
+def api_create_movements_bulk(
+    items: list[MovementCreate] = Depends(movement_batch),
+    db: Session = Depends(get_db),
+    _auth=Depends(RequireAuth),
+):
+    # Registra un lote de movimientos (array JSON o NDJSON) en una única transacción.
+    # Las líneas con idempotency_key ya registrada devuelven el movimiento original.
+    try:
+        return record_movements_bulk(
+            db, [(it.product_id, it.delta, it.reason) for it in items], [it.idempotency_key for it in items],
+        )
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=f"Producto no encontrado: {e.args[0]}")
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail=f"Stock disponible insuficiente: {e.args[0]}")
+
+@inventory.get("/api/movements", response_model=list[MovementOut])
+def api_list_movements(
+    request: Request,
+    params: MovementListParams = Depends(movement_list_params),
+    db: Session = Depends(get_read_db),
+    _auth=Depends(RequireAuth),
+):
+    # Lista movimientos de stock, opcionalmente filtrados por producto, tipo y fechas [since, until).
+    # Si hay más resultados, la cabecera X-Next-Cursor trae el cursor de la página siguiente.
+    cond = conditional(request, data_version(db))
+    if cond.response is not None:
+        return cond.response
+    return cond.store(*movements_page(list_movements(db, rows=FAST_SERIALIZATION, **params.filters()), params))
+
+
+@router.post("/api/products/import", response_model=ImportReport, tags=["inventory"])
+def api_import_products(
+    file: UploadFile = File(...),
+    format: Literal["csv", "ndjson"] | None = None,
+    db: Session = Depends(get_db),
+    _auth=Depends(RequireAuth),
+):
+    # Importa (upsert por SKU) un catálogo CSV o NDJSON; los errores se devuelven por fila
+    return import_products(db, file.file, format or detect_format(file.filename, file.content_type))
+
+# ------- Stock histórico -------
+@router.get("/api/products/{product_id}/stock", response_model=StockAt, tags=["inventory"])
+def api_stock_at(product_id: int, at: datetime, db: Session = Depends(get_read_db), _auth=Depends(RequireAuth)):
+    # Stock del producto en el instante at, a partir del snapshot diario y la cola de movimientos
+    try:
+        qty = stock_at(db, product_id, at)
+    except ArchivedPeriodError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if qty is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return StockAt(product_id=product_id, at=naive_utc(at), stock_qty=qty)
+
+# ------- Reservas -------
+@router.get("/api/products/{product_id}/availability", response_model=Availability, tags=["reservations"])
+def api_availability(product_id: int, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
+    # Stock físico, reservado y disponible (stock - reservado); del primario, porque se consulta antes de reservar
+    result = availability(db, product_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return result
+
+# ------- Exportación -------
+def export_response(db: Session, query, columns: tuple[str, ...], fmt: str, name: str, archived=None) -> StreamingResponse:
+    # Respuesta en streaming con el fichero de exportación (CSV o NDJSON)
+    return StreamingResponse(
+        stream_export(db.get_bind(), query, columns, fmt, archived),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
+
+@router.get("/api/export/products", tags=["export"])
+def api_export_products(
+    format: Literal["csv", "ndjson"] = "csv",
+    db: Session = Depends(get_read_db),
+    _auth=Depends(RequireAuth),
+):
+    # Exporta todos los productos en streaming
+    return export_response(db, products_query(), PRODUCT_FIELDS, format, "products")
+
+@router.get("/api/export/movements", tags=["export"])
+def api_export_movements(
+    format: Literal["csv", "ndjson"] = "csv",
+    product_id: int | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    db: Session = Depends(get_read_db),
+    _auth=Depends(RequireAuth),
+):
+    # Exporta el historial de movimientos en streaming, filtrado por producto y rango de fechas [since, until).
+    # Incluye los meses archivados, leídos de sus ficheros e intercalados en orden cronológico.
+    # Los límites se pasan a UTC sin zona como created_at (compararlos con zona fallaría ya en pleno stream).
+    since, until = (naive_utc(v) if v else None for v in (since, until))
+    archived = archived_movements(db.get_bind(), product_id, since, until)
+    return export_response(db, movements_query(product_id, since, until), MOVEMENT_FIELDS, format, "movements", archived)
+
+# ------- Aplicación -------
+def create_app() -> FastAPI:
+    """
+    Construye la aplicación (middlewares y routers) sin conectarse a la base de datos, así que un worker
+    arranca aunque esta aún no esté disponible. También sirve de fábrica: uvicorn app.main:create_app --factory
+    """
+    app = FastAPI(title="Inventory API", version="0.1.0", lifespan=lifespan)
+
+    # Configura CORS para permitir peticiones desde el frontend definido en CORS_ORIGINS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[o.strip() for o in CORS_ORIGINS.split(",")],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Cursor de la página siguiente, versión de los listados y movimientos repetidos por clave de idempotencia
+        expose_headers=["X-Next-Cursor", "ETag", "Idempotent-Replayed"],
+    )
+    # Compresión de respuestas grandes (gzip o Brotli), excepto los streams SSE
+    app.add_middleware(CompressionMiddleware)
+    # Tras una escritura, el cliente lee del primario durante DB_READ_STICKY_SECONDS (solo con réplicas)
+    app.add_middleware(ReadYourWritesMiddleware)
+    # Consultas SQL y tiempo por petición (Server-Timing y /metrics); el último añadido es el más externo
+    app.add_middleware(InstrumentationMiddleware)
+
+    # Incluye el router de autenticación (síncrono o asíncrono según DB_ASYNC)
+    app.include_router(async_auth_router if DB_ASYNC else auth_router)
+    app.include_router(router)
+    app.include_router(async_inventory if DB_ASYNC else inventory)
+    app.include_router(reservations_router)
+    app.include_router(scan_router)
+    # Informes y eventos en tiempo real
+    app.include_router(reports_router)
+    app.include_router(events_router)
+    return app
 
-@app.get("/api/movements", response_model=list[MovementOut], tags=["inventory"])
-def api_list_movements(product_id: int | None = None, limit: int = 100, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
-    # Lista movimientos de stock, opcionalmente filtrados por producto, con límite de registros
-    return list_movements(db, product_id=product_id, limit=limit)
+app = create_app()
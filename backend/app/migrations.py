@@ -0,0 +1,120 @@
+"""
+Migraciones versionadas del esquema. La aplicación ya no crea tablas al arrancar: el esquema se crea o
+actualiza con un paso explícito antes de desplegar (o desde seed.py), una sola vez y no en cada worker.
+
+    python -m app.migrations            # aplica las migraciones pendientes
+    python -m app.migrations --status   # versión actual y migraciones pendientes
+
+Cada migración se aplica en su propia transacción junto con su fila en schema_version. Son idempotentes:
+una base de datos creada con versiones anteriores (create_all al importar app.main) se pone al día sin
+errores aunque ya tenga parte de las tablas.
+"""
+
+import argparse
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from . import models
+from .database import Base, get_engine
+
+# Fuera de Base.metadata: create_all de los tests y benchmarks no la crea ni la borra
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATION_LOCK_ID = 72_410_001  # pg_advisory_xact_lock: dos procesos no aplican la misma migración a la vez
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+def _create_tables(conn: Connection) -> None:
+    # Tablas que falten (en una base de datos nueva, el esquema completo con sus índices)
+    Base.metadata.create_all(conn)
+
+def _products_reserved_qty(conn: Connection) -> None:
+    # products.reserved_qty (reservas de stock) en tablas creadas antes de existir la columna
+    if "reserved_qty" in {c["name"] for c in inspect(conn).get_columns("products")}:
+        return
+    conn.execute(text("ALTER TABLE products ADD COLUMN reserved_qty INTEGER NOT NULL DEFAULT 0"))
+    if conn.dialect.name == "postgresql":  # SQLite no admite añadir restricciones con ALTER TABLE
+        conn.execute(text("ALTER TABLE products ADD CONSTRAINT product_reserved_check CHECK (reserved_qty >= 0)"))
+
+def _listing_indexes(conn: Connection) -> None:
+    # Índices de los listados paginados y de updated_since en tablas ya existentes
+    tables = (models.Product.__table__, models.StockMovement.__table__)
+    for index in (i for t in tables for i in t.indexes):
+        index.create(conn, checkfirst=True)
+
+def _movement_window(conn: Connection) -> None:
+    # Ventana de totales de los informes (app.snapshots la llena en el siguiente rollup)
+    models.MovementWindow.__table__.create(conn, checkfirst=True)
+    if "window_start" not in {c["name"] for c in inspect(conn).get_columns("snapshot_state")}:
+        conn.execute(text("ALTER TABLE snapshot_state ADD COLUMN window_start TIMESTAMP"))
+
+MIGRATIONS = [
+    Migration(1, "create_tables", _create_tables),
+    Migration(2, "products_reserved_qty", _products_reserved_qty),
+    Migration(3, "listing_indexes", _listing_indexes),
+    Migration(4, "movement_window", _movement_window),
+]
+
+def current_version(conn: Connection) -> int:
+    """Última versión aplicada (0 si la base de datos aún no tiene schema_version)"""
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())).scalar() or 0
+
+def pending(conn: Connection) -> list[Migration]:
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m.version > version]
+
+def migrate(engine: Engine, target: int | None = None) -> list[Migration]:
+    """Aplica las migraciones pendientes hasta target (por defecto la última) y devuelve las aplicadas"""
+    applied = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.version > target:
+            break
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            schema_version.create(conn, checkfirst=True)
+            if current_version(conn) >= migration.version:
+                continue
+            migration.apply(conn)
+            conn.execute(schema_version.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow(),
+            ))
+        applied.append(migration)
+    return applied
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.migrations", description="Migraciones del esquema")
+    parser.add_argument("--status", action="store_true", help="Mostrar la versión actual y las migraciones pendientes")
+    parser.add_argument("--target", type=int, help="Aplicar solo hasta esta versión")
+    args = parser.parse_args(argv)
+
+    engine = get_engine()
+    if args.status:
+        with engine.connect() as conn:
+            print(f"Versión actual: {current_version(conn)}")
+            for m in pending(conn):
+                print(f"  pendiente: {m.version} {m.name}")
+        return
+    applied = migrate(engine, args.target)
+    for m in applied:
+        print(f"Aplicada: {m.version} {m.name}")
+    print("Esquema al día." if not applied else f"{len(applied)} migraciones aplicadas.")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
 """
 Define los modelos de la base de datos: usuarios, productos y movimientos de stock.
-Incluye relaciones entre productos y sus movimientos y restricciones de integridad.
+Incluye relaciones entre productos y sus movimientos y restricciones de integridad,
+y los resúmenes diarios de stock (snapshots) calculados a partir de los movimientos,
+con los totales por producto de los últimos días que usan los informes.
+Las reservas apartan stock para pedidos: disponible = stock_qty - reserved_qty.
+Los meses de movimientos archivados (app.archive) conservan un resumen por producto.
 """
 
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, CheckConstraint
+from datetime import date, datetime
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, CheckConstraint, Index
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from .database import Base
 
@@ -24,13 +29,23 @@ class Product(Base):
     ean13: Mapped[str] = mapped_column(String(13), unique=True, index=True, nullable=False)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     stock_qty: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    reserved_qty: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)  # Suma de reservas activas
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     movements: Mapped[list["StockMovement"]] = relationship(
         back_populates="product", cascade="all, delete-orphan"
     )  # Relación a los movimientos de stock
 
+    __table_args__ = (
+        CheckConstraint("reserved_qty >= 0", name="product_reserved_check"),
+    )
+
+    @hybrid_property
+    def available(self) -> int:
+        # Stock que se puede reservar (en Python y en SQL: select(Product.available))
+        return self.stock_qty - self.reserved_qty
+
 class StockMovement(Base):
     # Modelo de movimiento de stock: registra entradas, salidas o ajustes
     __tablename__ = "stock_movements"
@@ -47,4 +62,90 @@ class StockMovement(Base):
 
     __table_args__ = (
         CheckConstraint("type in ('IN','OUT','ADJUST')", name="movement_type_check"),  # Restricción de tipo
+        Index("ix_stock_movements_product_created_id", "product_id", "created_at", "id"),  # Paginación por producto
+        Index("ix_stock_movements_created_id", "created_at", "id"),  # Paginación sin filtro de producto
+    )
+
+class StockSnapshot(Base):
+    # Resumen diario por producto: stock al cierre del día y totales de entradas/salidas (por signo de delta)
+    __tablename__ = "stock_snapshots"
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    qty_close: Mapped[int] = mapped_column(Integer, nullable=False)  # qty_after del último movimiento del día
+    qty_in: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    qty_out: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_movement_id: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_stock_snapshots_day", "day"),  # Informe de niveles de stock por fecha
+    )
+
+class SnapshotState(Base):
+    # Marca de agua del rollup: último movimiento ya agregado en stock_snapshots (una sola fila, id=1)
+    __tablename__ = "snapshot_state"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    last_movement_id: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_movement_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    window_start: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # Inicio de movement_window (medianoche UTC)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class MovementWindow(Base):
+    # Totales por producto de los movimientos agregados desde SnapshotState.window_start (ventana de los informes)
+    __tablename__ = "movement_window"
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    movements: Mapped[int] = mapped_column(Integer, nullable=False)
+    qty_in: Mapped[int] = mapped_column(Integer, nullable=False)  # Unidades de entradas (IN), como en app.reports
+    qty_out: Mapped[int] = mapped_column(Integer, nullable=False)  # Unidades de salidas (OUT)
+    net: Mapped[int] = mapped_column(Integer, nullable=False)  # Suma de todos los delta, ajustes incluidos
+
+class Reservation(Base):
+    # Reserva de stock para un pedido: ACTIVE hasta que se confirma (COMMITTED), se libera (RELEASED) o caduca (EXPIRED)
+    __tablename__ = "reservations"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"), index=True, nullable=False)
+    qty: Mapped[int] = mapped_column(Integer, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), default="ACTIVE", nullable=False)
+    reference: Mapped[str | None] = mapped_column(String(255), nullable=True)  # Referencia del pedido
+    # Salida al confirmar; sin clave foránea: con stock_movements particionada la clave primaria es (id, created_at)
+    movement_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        CheckConstraint("qty > 0", name="reservation_qty_check"),
+        CheckConstraint("status in ('ACTIVE','COMMITTED','RELEASED','EXPIRED')", name="reservation_status_check"),
+        Index("ix_reservations_status_expires", "status", "expires_at"),  # Barrido de reservas caducadas
     )
+
+class MovementArchive(Base):
+    # Mes de movimientos archivado en un fichero NDJSON comprimido con gzip (ver app/archive.py)
+    __tablename__ = "movement_archives"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    period_start: Mapped[datetime] = mapped_column(DateTime, unique=True, nullable=False)  # Primer día del mes
+    period_end: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # Primer día del mes siguiente
+    path: Mapped[str] = mapped_column(String(512), nullable=False)  # Relativo a MOVEMENTS_ARCHIVE_DIR
+    rows: Mapped[int] = mapped_column(Integer, nullable=False)
+    size_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class MovementSummary(Base):
+    # Resumen por producto de un mes archivado: entradas, salidas y stock al principio y al final del mes
+    __tablename__ = "movement_summaries"
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    period_start: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    movements: Mapped[int] = mapped_column(Integer, nullable=False)
+    qty_in: Mapped[int] = mapped_column(Integer, nullable=False)
+    qty_out: Mapped[int] = mapped_column(Integer, nullable=False)
+    opening_qty: Mapped[int] = mapped_column(Integer, nullable=False)
+    closing_qty: Mapped[int] = mapped_column(Integer, nullable=False)
+
+class IdempotencyKey(Base):
+    # Clave de idempotencia de un movimiento: un reintento con la misma clave devuelve el movimiento original
+    __tablename__ = "idempotency_keys"
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    request_hash: Mapped[str] = mapped_column(String(32), nullable=False)  # Huella de product_id, delta y reason
+    # Sin clave foránea, como Reservation.movement_id; NULL mientras la petición original está en curso
+    movement_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True, nullable=False)  # Purga de caducadas
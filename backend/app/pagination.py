@@ -0,0 +1,24 @@
+"""
+Cursores opacos para paginación por keyset (seek) en los listados de la API.
+El cursor codifica en base64 la clave de ordenación de la última fila devuelta.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+def encode_cursor(*values) -> str:
+    """Codifica la clave de la última fila (fechas en ISO 8601) como cursor opaco"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    """Decodifica un cursor generado por encode_cursor; lanza ValueError si no es válido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Cursor inválido") from e
+    if not isinstance(values, list):
+        raise ValueError("Cursor inválido")
+    return values
@@ -0,0 +1,160 @@
+"""
+Particionado mensual de stock_movements en PostgreSQL (particiones declarativas por rango de created_at).
+Cada mes vive en su propia tabla (stock_movements_AAAA_MM): los INSERT y el VACUUM trabajan sobre una partición
+pequeña, las consultas por fecha solo leen los meses del rango y archivar un mes antiguo es soltar su partición
+(app.archive). La conversión de la tabla existente se hace una vez con la aplicación parada:
+
+    python -m app.partitions            # convierte stock_movements y crea las particiones
+    python -m app.partitions --ensure   # solo crea las particiones de los próximos meses
+
+Con MOVEMENTS_PARTITIONED=true la aplicación crea además las particiones de los meses siguientes en segundo plano.
+En SQLite u otras bases de datos la tabla sigue sin particionar y el archivado borra las filas del mes.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import date, datetime
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .models import StockMovement
+
+MOVEMENTS_PARTITIONED = os.getenv("MOVEMENTS_PARTITIONED", "false").lower() == "true"  # stock_movements particionada (PostgreSQL)
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))  # Meses futuros con partición ya creada
+PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", "21600"))  # Segundos entre comprobaciones
+
+TABLE = StockMovement.__tablename__
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+logger = logging.getLogger(__name__)
+
+def month_start(value: date | datetime) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(month: date, n: int) -> date:
+    y, m = divmod(month.month - 1 + n, 12)
+    return date(month.year + y, m + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_{month:%Y_%m}"
+
+def is_partitioned(conn: Connection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid"
+        " WHERE c.relname = :name AND pg_table_is_visible(c.oid))"
+    ), {"name": TABLE}).scalar()
+
+def ensure_partitions(conn: Connection, since: date | None = None, months_ahead: int = PARTITION_MONTHS_AHEAD) -> list[str]:
+    """
+    Crea las particiones mensuales desde since (por defecto el mes actual) hasta months_ahead meses después.
+    Devuelve los nombres de las particiones comprobadas.
+    """
+    current = month_start(datetime.utcnow())
+    month, last = month_start(since or current), add_months(current, months_ahead)
+    names = []
+    while month <= last:
+        name = partition_name(month)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        names.append(name)
+        month = add_months(month, 1)
+    return names
+
+def convert_to_partitioned(engine: Engine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> bool:
+    """
+    Convierte stock_movements en tabla particionada por mes (una sola transacción; False si ya lo estaba).
+    - La clave primaria pasa a (id, created_at): PostgreSQL exige que incluya la clave de partición.
+    - Se eliminan las claves foráneas que apuntan a stock_movements (no pueden referenciar solo id).
+    - Las filas se copian a sus particiones; los índices del modelo se crean después de la copia.
+    - Una partición DEFAULT recoge las filas fuera de rango para que un INSERT nunca falle.
+    """
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("El particionado de stock_movements solo está disponible en PostgreSQL")
+    old = f"{TABLE}_unpartitioned"
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return False
+        foreign_keys = conn.execute(text(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE contype = 'f' AND confrelid = CAST(:name AS regclass)"
+        ), {"name": TABLE}).all()
+        for table, constraint in foreign_keys:
+            conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"'))
+        first = conn.execute(text(f"SELECT min(created_at) FROM {TABLE}")).scalar()
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": TABLE}).scalar()
+        primary_key = conn.execute(text(
+            "SELECT conname FROM pg_constraint WHERE contype = 'p' AND conrelid = CAST(:name AS regclass)"
+        ), {"name": TABLE}).scalar()
+
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {old}"))
+        if primary_key:  # Libera el nombre (stock_movements_pkey) para la clave primaria de la tabla nueva
+            conn.execute(text(f'ALTER TABLE {old} RENAME CONSTRAINT "{primary_key}" TO "{old}_pkey"'))
+        conn.execute(text(
+            f"CREATE TABLE {TABLE} ("
+            f" LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS,"
+            f" PRIMARY KEY (id, created_at),"
+            f" FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE"
+            f") PARTITION BY RANGE (created_at)"
+        ))
+        ensure_partitions(conn, month_start(first) if first else None, months_ahead)
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+        conn.execute(text(f"INSERT INTO {TABLE} SELECT * FROM {old}"))
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id"))
+        conn.execute(text(f"DROP TABLE {old}"))
+        for index in StockMovement.__table__.indexes:
+            index.create(conn)
+    return True
+
+def drop_partition(conn: Connection, month: date) -> bool:
+    """Separa y elimina la partición de un mes (tras archivarla); False si no existe"""
+    name = partition_name(month)
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+        return False
+    conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+    return True
+
+async def partition_loop(engine: Engine, interval: float = PARTITION_CHECK_INTERVAL):
+    """Crea en segundo plano las particiones de los próximos meses (tarea del lifespan de la aplicación)"""
+    def run_once():
+        with engine.begin() as conn:
+            if is_partitioned(conn):
+                ensure_partitions(conn)
+
+    while True:
+        try:
+            await run_in_threadpool(run_once)
+        except Exception:
+            logger.exception("Error al crear las particiones de %s", TABLE)
+        await asyncio.sleep(interval)
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.partitions", description="Particionado mensual de stock_movements")
+    parser.add_argument("--ensure", action="store_true", help="Solo crear las particiones de los próximos meses")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    args = parser.parse_args(argv)
+
+    from .database import get_engine
+
+    engine = get_engine()
+
+    if args.ensure:
+        with engine.begin() as conn:
+            if not is_partitioned(conn):
+                raise SystemExit(f"{TABLE} no está particionada (ejecutar antes python -m app.partitions)")
+            print("\n".join(ensure_partitions(conn, months_ahead=args.months_ahead)))
+    elif convert_to_partitioned(engine, args.months_ahead):
+        print(f"{TABLE} convertida en tabla particionada por mes.")
+    else:
+        print(f"{TABLE} ya estaba particionada.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Informes de inventario sobre todo el catálogo: rotación, consumo diario, días de cobertura y productos con más movimiento.
+Toda la agregación se hace en SQL (GROUP BY sobre stock_movements en el rango de fechas) y solo se devuelven
+filas ya calculadas, ordenadas y limitadas en la base de datos; nunca se cargan objetos ORM por movimiento.
+Los rangos recientes parten de los totales que mantiene el rollup (movement_window) y solo agregan los
+movimientos de los bordes, en lugar de todos los del rango.
+"""
+
+from datetime import date, datetime, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import Float, Select, and_, case, cast, func, nulls_last, select, union_all
+from sqlalchemy.orm import Session, aliased
+
+from .database import get_read_db
+from .deps import RequireAuth
+from .models import MovementWindow, Product, SnapshotState, StockMovement
+from .pagination import encode_cursor, decode_cursor
+from .schemas import ProductMetrics, StockLevel
+from .snapshots import naive_utc, stock_levels
+
+REPORT_DEFAULT_DAYS = 30  # Rango por defecto: últimos 30 días
+
+def _metrics_select(qty_in, qty_out, movements, opening, closing, since: datetime, until: datetime) -> Select:
+    # Métricas de cada producto a partir de sus totales y del stock al principio y al final del rango
+    days = max((until - since).total_seconds() / 86400, 1e-9)
+    consumption = cast(qty_out, Float) / days
+    avg_stock = cast(opening + closing, Float) / 2.0
+    return select(
+        Product.id.label("product_id"),
+        Product.sku,
+        Product.name,
+        Product.stock_qty,
+        qty_in.label("qty_in"),
+        qty_out.label("qty_out"),
+        movements.label("movements"),
+        opening.label("opening_qty"),
+        closing.label("closing_qty"),
+        consumption.label("consumption_per_day"),
+        (cast(qty_out, Float) / func.nullif(avg_stock, 0, type_=Float)).label("turnover"),
+        (cast(Product.stock_qty, Float) / func.nullif(consumption, 0, type_=Float)).label("days_of_cover"),
+    )
+
+def metrics_query(since: datetime, until: datetime) -> Select:
+    """
+    Una fila por producto con movimientos en [since, until):
+    - qty_in / qty_out: unidades de entradas (IN) y salidas (OUT); los ajustes no cuentan como consumo
+    - opening_qty / closing_qty: stock antes del primer y después del último movimiento del rango
+    - consumption_per_day: qty_out / días del rango
+    - turnover: qty_out / stock medio ((apertura + cierre) / 2)
+    - days_of_cover: stock actual / consumo diario
+    """
+    agg = (
+        select(
+            StockMovement.product_id,
+            func.sum(case((StockMovement.type == "IN", StockMovement.delta), else_=0)).label("qty_in"),
+            func.sum(case((StockMovement.type == "OUT", -StockMovement.delta), else_=0)).label("qty_out"),
+            func.count().label("movements"),
+            func.min(StockMovement.id).label("first_id"),
+            func.max(StockMovement.id).label("last_id"),
+        )
+        .where(StockMovement.created_at >= since, StockMovement.created_at < until)
+        .group_by(StockMovement.product_id)
+        .subquery()
+    )
+    first = aliased(StockMovement)
+    last = aliased(StockMovement)
+    return (
+        _metrics_select(agg.c.qty_in, agg.c.qty_out, agg.c.movements, first.qty_before, last.qty_after, since, until)
+        .join(agg, agg.c.product_id == Product.id)
+        .join(first, first.id == agg.c.first_id)
+        .join(last, last.id == agg.c.last_id)
+    )
+
+def window_metrics_query(since: datetime, until: datetime) -> Select:
+    """
+    Las mismas filas que metrics_query, a partir de movement_window (ver app.snapshots) en lugar de todo el rango.
+    La ventana suma los movimientos con ID <= marca de agua y created_at >= window_start; cada movimiento cuenta
+    (en el rango) - (en la ventana), así que solo se leen los que difieren: los del borde entre window_start y since,
+    los posteriores a until y la cola aún no agregada. El stock final es el actual menos lo movido desde until.
+    La marca de agua y el inicio se leen en la misma sentencia: un rollup concurrente no descuadra el resultado.
+    """
+    watermark = select(SnapshotState.last_movement_id).where(SnapshotState.id == 1).scalar_subquery()
+    window_start = select(SnapshotState.window_start).where(SnapshotState.id == 1).scalar_subquery()
+    in_range = and_(StockMovement.created_at >= since, StockMovement.created_at < until)
+    in_window = and_(StockMovement.id <= watermark, StockMovement.created_at >= window_start)
+    factor = case((in_range, 1), else_=0) - case((in_window, 1), else_=0)
+    columns = (
+        StockMovement.product_id,
+        factor.label("movements"),
+        (factor * case((StockMovement.type == "IN", StockMovement.delta), else_=0)).label("qty_in"),
+        (factor * case((StockMovement.type == "OUT", -StockMovement.delta), else_=0)).label("qty_out"),
+        (factor * StockMovement.delta).label("net"),
+        case((StockMovement.created_at >= until, StockMovement.delta), else_=0).label("after"),
+    )
+    # Tres rangos disjuntos, cada uno por su índice: la cola hasta until, todo lo posterior y el borde de la ventana
+    moved = union_all(
+        select(*columns).where(StockMovement.id > watermark, StockMovement.created_at < until),
+        select(*columns).where(StockMovement.created_at >= until),
+        select(*columns).where(
+            StockMovement.id <= watermark,
+            StockMovement.created_at >= case((window_start < since, window_start), else_=since),
+            StockMovement.created_at < case((window_start > since, window_start), else_=since),
+            StockMovement.created_at < until,
+        ),
+    ).subquery()
+    corrections = (
+        select(moved.c.product_id, *(func.sum(c).label(c.name) for c in list(moved.c)[1:]))
+        .group_by(moved.c.product_id)
+        .subquery()
+    )
+    def total(column: str):
+        return func.coalesce(getattr(MovementWindow, column), 0) + func.coalesce(corrections.c[column], 0)
+
+    closing = Product.stock_qty - func.coalesce(corrections.c.after, 0)
+    # Desde products: la cola puede traer productos que aún no están en la ventana
+    return (
+        _metrics_select(total("qty_in"), total("qty_out"), total("movements"), closing - total("net"), closing, since, until)
+        .outerjoin(MovementWindow, MovementWindow.product_id == Product.id)
+        .outerjoin(corrections, corrections.c.product_id == Product.id)
+        .where(total("movements") > 0)
+    )
+
+def report_query(db: Session, since: datetime, until: datetime) -> Select:
+    """
+    metrics_query o window_metrics_query: la ventana cuando los movimientos que hay que corregir (entre su inicio y
+    since y desde until hasta ahora) cubren menos tiempo que el propio rango, como en el rango por defecto.
+    """
+    start = db.scalar(select(SnapshotState.window_start).where(SnapshotState.id == 1))
+    if start is not None and abs(since - start) + max(datetime.utcnow() - until, timedelta(0)) < until - since:
+        return window_metrics_query(since, until)
+    return metrics_query(since, until)
+
+def report_range(
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = Query(50, ge=1, le=1000),
+) -> tuple[datetime, datetime, int]:
+    # Rango [since, until) de los informes; por defecto los últimos REPORT_DEFAULT_DAYS días
+    until = naive_utc(until) if until else datetime.utcnow()
+    since = naive_utc(since) if since else until - timedelta(days=REPORT_DEFAULT_DAYS)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="Rango de fechas inválido")
+    return since, until, limit
+
+def ranked(db: Session, since: datetime, until: datetime, order, limit: int):
+    # Ejecuta el informe ordenado y limitado en SQL (desempate por ID de producto)
+    q = report_query(db, since, until)
+    return db.execute(q.order_by(order(q.selected_columns), Product.id).limit(limit)).all()
+
+# ------- Rutas -------
+router = APIRouter(prefix="/api/reports", tags=["reports"])
+
+@router.get("/turnover", response_model=list[ProductMetrics])
+def turnover(rng=Depends(report_range), db: Session = Depends(get_read_db), _auth=Depends(RequireAuth)):
+    """Productos con mayor rotación (salidas / stock medio) en el rango"""
+    since, until, limit = rng
+    return ranked(db, since, until, lambda c: nulls_last(c.turnover.desc()), limit)
+
+@router.get("/consumption", response_model=list[ProductMetrics])
+def consumption(rng=Depends(report_range), db: Session = Depends(get_read_db), _auth=Depends(RequireAuth)):
+    """Productos con mayor consumo diario en el rango"""
+    since, until, limit = rng
+    return ranked(db, since, until, lambda c: c.consumption_per_day.desc(), limit)
+
+@router.get("/days-of-cover", response_model=list[ProductMetrics])
+def days_of_cover(rng=Depends(report_range), db: Session = Depends(get_read_db), _auth=Depends(RequireAuth)):
+    """Productos con menos días de cobertura (primero los que antes se quedarán sin stock); solo los que tienen consumo"""
+    since, until, limit = rng
+    q = report_query(db, since, until)
+    q = q.where(q.selected_columns.qty_out > 0)
+    return db.execute(q.order_by(q.selected_columns.days_of_cover.asc(), Product.id).limit(limit)).all()
+
+@router.get("/top-movers", response_model=list[ProductMetrics])
+def top_movers(rng=Depends(report_range), db: Session = Depends(get_read_db), _auth=Depends(RequireAuth)):
+    """Productos con más unidades movidas (entradas + salidas) en el rango"""
+    since, until, limit = rng
+    return ranked(db, since, until, lambda c: (c.qty_in + c.qty_out).desc(), limit)
+
+@router.get("/stock-levels", response_model=list[StockLevel])
+def api_stock_levels(
+    response: Response,
+    day: date = Query(..., alias="date"),
+    limit: int = Query(500, ge=1, le=1000),
+    cursor: str | None = None,
+    db: Session = Depends(get_read_db),
+    _auth=Depends(RequireAuth),
+):
+    """Stock al cierre del día y entradas/salidas de ese día por producto, paginado con X-Next-Cursor"""
+    after_id = None
+    if cursor:
+        try:
+            (after_id,) = decode_cursor(cursor)
+            after_id = int(after_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    levels = stock_levels(db, day, limit, after_id)
+    if len(levels) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(levels[-1].product_id)
+    return levels
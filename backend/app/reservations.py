@@ -0,0 +1,320 @@
+"""
+Reservas de stock para pedidos: reserve / commit / release con caducidad.
+Reservar suma al reserved_qty del producto con un UPDATE condicional (solo si hay disponible suficiente),
+confirmar convierte la reserva en un movimiento OUT y liberar o caducar devuelve las unidades al disponible.
+Los productos más vendidos reciben muchas reservas a la vez sobre la misma fila: las reservas concurrentes
+de un mismo producto se agrupan en este worker y se aplican en una sola transacción (ReservationCombiner),
+así que la fila se bloquea una vez por lote y no una vez por pedido.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Update, case, insert, select, update
+from sqlalchemy.orm import Session
+
+from .crud import InsufficientStock, movement_for
+from .database import get_db
+from .deps import RequireAuth
+from .events import queue_events
+from .http_cache import invalidate_responses
+from .models import Product, Reservation
+from .schemas import Availability, ReservationCreate, ReservationOut
+
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", "900"))  # Segundos de vida por defecto de una reserva
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))  # Segundos entre barridos de caducadas (0 = desactivado)
+RESERVATION_BATCHING = os.getenv("RESERVATION_BATCHING", "true").lower() == "true"  # Agrupar reservas concurrentes
+RESERVATION_BATCH_MAX = int(os.getenv("RESERVATION_BATCH_MAX", "256"))  # Reservas por transacción como máximo
+
+logger = logging.getLogger(__name__)
+
+class ReservationNotActive(Exception):
+    """La reserva ya se confirmó, se liberó o ha caducado"""
+
+# ------- Reservar -------
+@dataclass(eq=False)
+class ReserveRequest:
+    product_id: int
+    qty: int
+    expires_at: datetime
+    reference: str | None = None
+    result: dict | None = None  # Fila de la reserva creada; None = sin stock
+    error: BaseException | None = None
+    done: bool = False
+    lead: bool = False  # Este hilo aplica el siguiente lote del producto
+    wake: threading.Event = field(default_factory=threading.Event)
+
+def reserve_stmt(product_id: int, qty: int) -> Update:
+    # Suma qty a las reservas solo si cabe en el disponible; sin fila devuelta = no cabe (o no existe)
+    return (
+        update(Product)
+        .where(Product.id == product_id, Product.stock_qty - Product.reserved_qty >= qty)
+        .values(reserved_qty=Product.reserved_qty + qty)
+        .returning(Product.stock_qty)
+        .execution_options(synchronize_session=False)
+    )
+
+def lock_product_stmt(product_id: int) -> Update:
+    # Bloquea la fila y devuelve stock y reservado (como crud.stock_lock_stmt)
+    return (
+        update(Product)
+        .where(Product.id == product_id)
+        .values(reserved_qty=Product.reserved_qty)
+        .returning(Product.stock_qty, Product.reserved_qty)
+        .execution_options(synchronize_session=False)
+    )
+
+RESERVATION_INSERT = insert(Reservation).returning(Reservation.id, sort_by_parameter_order=True)
+
+def reserve_many(db: Session, product_id: int, requests: list[ReserveRequest]) -> list[dict | None]:
+    """
+    Aplica en una transacción las reservas de un producto, en orden de llegada.
+    Si caben todas basta un UPDATE condicional; si no, se bloquea la fila y se conceden las que quepan.
+    Devuelve la fila creada de cada reserva o None si no había disponible. LookupError si el producto no existe.
+    """
+    total = sum(r.qty for r in requests)
+    if db.execute(reserve_stmt(product_id, total)).first() is not None:
+        granted = list(requests)
+    else:
+        row = db.execute(lock_product_stmt(product_id)).first()
+        if row is None:
+            db.rollback()
+            raise LookupError(product_id)
+        available = row.stock_qty - row.reserved_qty
+        granted = []
+        for r in requests:
+            if r.qty <= available:
+                available -= r.qty
+                granted.append(r)
+        if granted:
+            db.execute(
+                update(Product)
+                .where(Product.id == product_id)
+                .values(reserved_qty=Product.reserved_qty + sum(r.qty for r in granted))
+                .execution_options(synchronize_session=False)
+            )
+    if not granted:
+        db.rollback()
+        return [None] * len(requests)
+
+    now = datetime.utcnow()
+    rows = [
+        {"product_id": product_id, "qty": r.qty, "status": "ACTIVE", "reference": r.reference,
+         "movement_id": None, "created_at": now, "expires_at": r.expires_at, "updated_at": now}
+        for r in granted
+    ]
+    ids = db.execute(RESERVATION_INSERT, rows).scalars().all()
+    db.commit()
+    results = {}
+    for r, row, reservation_id in zip(granted, rows, ids):
+        row["id"] = reservation_id
+        results[id(r)] = row
+    return [results.get(id(r)) for r in requests]
+
+class ReservationCombiner:
+    """
+    Agrupa reservas concurrentes del mismo producto (combinación plana). El primer hilo que llega aplica
+    su reserva junto con las que se acumulen mientras tanto (hasta max_batch) usando su propia sesión;
+    al terminar despierta a los demás con su resultado y cede el turno al primero que siga esperando.
+    Solo agrupa dentro de un worker; entre workers sigue decidiendo el bloqueo de la fila.
+    """
+
+    def __init__(self, max_batch: int = RESERVATION_BATCH_MAX):
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: dict[int, list[ReserveRequest]] = {}
+
+    def submit(self, db: Session, req: ReserveRequest) -> dict | None:
+        with self._lock:
+            queue = self._pending.get(req.product_id)
+            if queue is None:
+                self._pending[req.product_id] = queue = []
+                req.lead = True
+            queue.append(req)
+        while not req.done:
+            if req.lead:
+                self._apply_batch(db, req.product_id)
+            else:
+                req.wake.wait()
+                req.wake.clear()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _apply_batch(self, db: Session, product_id: int) -> None:
+        with self._lock:
+            queue = self._pending[product_id]
+            batch, queue[:] = queue[:self.max_batch], queue[self.max_batch:]
+        try:
+            results = reserve_many(db, product_id, batch)
+        except Exception as e:
+            db.rollback()
+            results, error = [None] * len(batch), e
+        else:
+            error = None
+        with self._lock:
+            queue = self._pending[product_id]
+            if queue:
+                queue[0].lead = True  # Cede el turno
+                queue[0].wake.set()
+            else:
+                del self._pending[product_id]
+        for r, result in zip(batch, results):
+            r.result, r.error, r.done, r.lead = result, error, True, False
+            r.wake.set()
+
+combiner = ReservationCombiner()
+
+def reserve(db: Session, product_id: int, qty: int, ttl: int | None = None, reference: str | None = None) -> dict:
+    """
+    Reserva qty unidades de un producto durante ttl segundos (RESERVATION_TTL por defecto).
+    Lanza InsufficientStock si no hay disponible y LookupError si el producto no existe.
+    """
+    req = ReserveRequest(product_id, qty, datetime.utcnow() + timedelta(seconds=ttl or RESERVATION_TTL), reference)
+    if RESERVATION_BATCHING:
+        result = combiner.submit(db, req)
+    else:
+        result = reserve_many(db, product_id, [req])[0]
+    if result is None:
+        raise InsufficientStock(product_id)
+    return result
+
+# ------- Confirmar / liberar / caducar -------
+def _close_stmt(reservation_id: int, status: str, now: datetime) -> Update:
+    # Cierra una reserva activa; la condición de estado hace que solo una operación concurrente gane
+    stmt = update(Reservation).where(Reservation.id == reservation_id, Reservation.status == "ACTIVE")
+    if status == "COMMITTED":
+        stmt = stmt.where(Reservation.expires_at > now)
+    return (
+        stmt.values(status=status, updated_at=now)
+        .returning(Reservation.product_id, Reservation.qty)
+        .execution_options(synchronize_session=False)
+    )
+
+def _closed(db: Session, reservation_id: int, status: str):
+    row = db.execute(_close_stmt(reservation_id, status, datetime.utcnow())).first()
+    if row is None:
+        db.rollback()
+        if db.get(Reservation, reservation_id) is None:
+            raise LookupError(reservation_id)
+        raise ReservationNotActive(reservation_id)
+    return row
+
+def commit_reservation(db: Session, reservation_id: int) -> Reservation:
+    """Confirma una reserva activa y no caducada: descuenta stock y reservado y registra la salida"""
+    product_id, qty = _closed(db, reservation_id, "COMMITTED")
+    after = db.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(stock_qty=Product.stock_qty - qty, reserved_qty=Product.reserved_qty - qty)
+        .returning(Product.stock_qty)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    m = movement_for(product_id, after, -qty, f"Reserva {reservation_id}", "OUT")
+    db.add(m)
+    db.flush()
+    db.execute(update(Reservation).where(Reservation.id == reservation_id).values(movement_id=m.id))
+    queue_events(db, [m])
+    db.commit()
+    invalidate_responses()
+    return db.get(Reservation, reservation_id)
+
+def release_reservation(db: Session, reservation_id: int) -> Reservation:
+    """Libera una reserva activa (también si ya ha caducado pero aún no se ha barrido)"""
+    product_id, qty = _closed(db, reservation_id, "RELEASED")
+    db.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(reserved_qty=Product.reserved_qty - qty)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return db.get(Reservation, reservation_id)
+
+def expire_reservations(db: Session, batch_size: int = 1000) -> int:
+    """Marca como EXPIRED las reservas activas caducadas y devuelve sus unidades al disponible"""
+    now = datetime.utcnow()
+    due = select(Reservation.id).where(Reservation.status == "ACTIVE", Reservation.expires_at <= now).limit(batch_size)
+    rows = db.execute(
+        update(Reservation)
+        .where(Reservation.id.in_(due), Reservation.status == "ACTIVE")
+        .values(status="EXPIRED", updated_at=now)
+        .returning(Reservation.product_id, Reservation.qty)
+        .execution_options(synchronize_session=False)
+    ).all()
+    totals: dict[int, int] = {}
+    for product_id, qty in rows:
+        totals[product_id] = totals.get(product_id, 0) + qty
+    if totals:
+        db.execute(
+            update(Product)
+            .where(Product.id.in_(totals))
+            .values(reserved_qty=Product.reserved_qty - case(totals, value=Product.id, else_=0))
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+    return len(rows)
+
+async def expiry_loop(session_factory, interval: float = RESERVATION_SWEEP_INTERVAL):
+    """Barrido periódico de reservas caducadas (tarea del lifespan de la aplicación)"""
+    def run_once():
+        with session_factory() as db:
+            while expire_reservations(db):
+                pass
+
+    while True:
+        try:
+            await run_in_threadpool(run_once)
+        except Exception:
+            logger.exception("Error en el barrido de reservas caducadas")
+        await asyncio.sleep(interval)
+
+def availability(db: Session, product_id: int) -> Availability | None:
+    row = db.execute(
+        select(Product.id, Product.stock_qty, Product.reserved_qty, Product.available).where(Product.id == product_id)
+    ).first()
+    return Availability(product_id=row[0], stock_qty=row[1], reserved_qty=row[2], available=row[3]) if row else None
+
+# ------- Rutas -------
+router = APIRouter(prefix="/api/reservations", tags=["reservations"])
+
+@router.post("", response_model=ReservationOut, status_code=201)
+def api_reserve(payload: ReservationCreate, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
+    """Reserva stock de un producto; 409 si no hay disponible suficiente"""
+    try:
+        return reserve(db, payload.product_id, payload.qty, payload.ttl_seconds, payload.reference)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    except InsufficientStock:
+        raise HTTPException(status_code=409, detail="Stock disponible insuficiente")
+
+@router.get("/{reservation_id}", response_model=ReservationOut)
+def api_get_reservation(reservation_id: int, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
+    reservation = db.get(Reservation, reservation_id)
+    if reservation is None:
+        raise HTTPException(status_code=404, detail="Reserva no encontrada")
+    return reservation
+
+def _close(action, db: Session, reservation_id: int) -> Reservation:
+    try:
+        return action(db, reservation_id)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Reserva no encontrada")
+    except ReservationNotActive:
+        raise HTTPException(status_code=409, detail="La reserva no está activa o ha caducado")
+
+@router.post("/{reservation_id}/commit", response_model=ReservationOut)
+def api_commit_reservation(reservation_id: int, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
+    """Confirma la reserva: el stock sale del inventario con un movimiento OUT"""
+    return _close(commit_reservation, db, reservation_id)
+
+@router.post("/{reservation_id}/release", response_model=ReservationOut)
+def api_release_reservation(reservation_id: int, db: Session = Depends(get_db), _auth=Depends(RequireAuth)):
+    """Libera la reserva y devuelve las unidades al disponible"""
+    return _close(release_reservation, db, reservation_id)
@@ -0,0 +1,132 @@
+"""
+Escaneo de códigos de barras en los puestos de empaquetado: POST /api/scan con un EAN13 o SKU y un delta.
+El código se resuelve con el índice en memoria (app.barcodes) y el movimiento se aplica en una sola ida y vuelta
+a la base de datos: en PostgreSQL un único INSERT ... SELECT sobre un UPDATE ... RETURNING (CTE) que suma el
+delta al stock y crea el movimiento; en SQLite, el UPDATE y el INSERT por separado. El UPDATE comprueba que
+el código sigue siendo del producto, así que una entrada obsoleta del índice nunca mueve stock de otro producto,
+y (como crud.stock_delta_stmt) que una salida cabe en el disponible, sin consumir stock reservado.
+"""
+
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy import DateTime, Integer, String, insert, literal, or_, select
+from sqlalchemy.orm import Session
+
+from . import barcodes
+from .crud import InsufficientStock, stock_delta_stmt
+from .database import get_db
+from .deps import RequireAuth
+from .events import queue_events
+from .http_cache import invalidate_responses
+from .idempotency import MOVEMENT_COLUMNS, IdempotencyError, bind_keys, replay_movement
+from .models import Product, StockMovement
+from .schemas import MovementOut, ScanCreate
+
+RETURNING = [getattr(StockMovement, c) for c in MOVEMENT_COLUMNS]
+
+def scan_update_stmt(product_id: int, code: str, delta: int):
+    # stock_delta_stmt (con su límite de disponible) solo si el código sigue siendo el EAN13 o el SKU del producto
+    return stock_delta_stmt(product_id, delta).where(or_(Product.ean13 == code, Product.sku == code)).returning(Product.id)
+
+def scan_stmt(product_id: int, code: str, delta: int, reason: str | None, now: datetime):
+    """
+    Sentencia única (PostgreSQL) del escaneo: UPDATE del stock en una CTE y movimiento con INSERT ... SELECT.
+    No devuelve filas si el código ya no es de ese producto o si la salida no cabe en el disponible.
+    """
+    scanned = scan_update_stmt(product_id, code, delta).cte("scanned")
+    return insert(StockMovement).from_select(
+        ["product_id", "delta", "qty_before", "qty_after", "reason", "type", "created_at"],
+        select(
+            scanned.c.id,
+            literal(delta, Integer),
+            scanned.c.stock_qty - delta,
+            scanned.c.stock_qty,
+            literal(reason, String(255)),
+            literal("IN" if delta >= 0 else "OUT", String(16)),
+            literal(now, DateTime),
+        ),
+    ).returning(*RETURNING)
+
+def apply_scan(db: Session, product_id: int, code: str, delta: int, reason: str | None) -> dict | None:
+    # Aplica el movimiento del escaneo sin confirmar; None si el código ya no es de ese producto o no hay disponible
+    now = datetime.utcnow()
+    if db.get_bind().dialect.name == "postgresql":
+        row = db.execute(scan_stmt(product_id, code, delta, reason, now)).mappings().first()
+        return dict(row) if row else None
+    updated = db.execute(scan_update_stmt(product_id, code, delta)).first()
+    if updated is None:
+        return None
+    after = updated.stock_qty
+    return dict(db.execute(
+        insert(StockMovement).values(
+            product_id=product_id, delta=delta, qty_before=after - delta, qty_after=after,
+            reason=reason, type="IN" if delta >= 0 else "OUT", created_at=now,
+        ).returning(*RETURNING)
+    ).mappings().one())
+
+def check_available(db: Session, product_id: int, code: str, delta: int) -> None:
+    # Tras un UPDATE sin filas: si era una salida y el código sigue siendo del producto, lo que faltaba era disponible
+    owned = select(Product.id).where(Product.id == product_id, or_(Product.ean13 == code, Product.sku == code))
+    if delta < 0 and db.execute(owned).first() is not None:
+        db.rollback()
+        raise InsufficientStock(product_id)
+
+def scan(db: Session, code: str, delta: int, reason: str | None = None, idempotency_key: str | None = None) -> dict | None:
+    """
+    Registra un movimiento a partir de un EAN13 o SKU; None si ningún producto tiene ese código.
+    Con el código en el índice es una sola sentencia más el commit; si no está (o está obsoleto) se resuelve
+    antes con una consulta por los índices únicos de ean13 y sku.
+    Lanza InsufficientStock si una salida consumiría stock reservado.
+    """
+    product_id = barcodes.lookup(code) or barcodes.resolve(db, code)
+    if product_id is None:
+        return None
+    row = apply_scan(db, product_id, code, delta, reason)
+    if row is None:
+        check_available(db, product_id, code, delta)
+        # El código ha cambiado de producto (importación u otro worker): se resuelve de nuevo
+        barcodes.forget(code)
+        product_id = barcodes.resolve(db, code)
+        if product_id is None:
+            return None
+        row = apply_scan(db, product_id, code, delta, reason)
+        if row is None:
+            # Ha vuelto a cambiar (o el producto se ha borrado) entre la resolución y el UPDATE
+            check_available(db, product_id, code, delta)
+            barcodes.forget(code)
+            return None
+    if idempotency_key is not None:
+        bind_keys(db, {idempotency_key: row["id"]})
+    queue_events(db, [row])
+    db.commit()
+    invalidate_responses()
+    return row
+
+# ------- Rutas -------
+router = APIRouter(prefix="/api/scan", tags=["scan"])
+
+@router.post("", response_model=MovementOut)
+def api_scan(
+    payload: ScanCreate,
+    response: Response,
+    idempotency_key: str | None = Header(None, min_length=1, max_length=255),
+    db: Session = Depends(get_db),
+    _auth=Depends(RequireAuth),
+):
+    """Registra un movimiento escaneando un EAN13 o SKU; 404 si el código no es de ningún producto, 409 si no hay disponible"""
+    if idempotency_key:
+        try:
+            original = replay_movement(db, idempotency_key, payload.code, payload.delta, payload.reason)
+        except IdempotencyError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        if original is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return original
+    try:
+        movement = scan(db, payload.code, payload.delta, payload.reason, idempotency_key)
+    except InsufficientStock:
+        raise HTTPException(status_code=409, detail="Stock disponible insuficiente")
+    if movement is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return movement
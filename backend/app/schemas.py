@@ -3,7 +3,7 @@ Define los esquemas Pydantic para validar y serializar datos de usuarios, produc
 Incluye validaciones, formatos de salida y estructuras para creación y lectura.
 """
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from pydantic import BaseModel, Field, field_validator, EmailStr
 
 # ---------- Autenticación ----------
@@ -58,12 +58,35 @@ class ProductOut(BaseModel):
     class Config:
         from_attributes = True
 
+# ---------- Importación de catálogo ----------
+class ImportRowError(BaseModel):
+    # Error de una fila concreta del fichero importado
+    line: int  # Número de línea en el fichero (la cabecera CSV es la línea 1)
+    sku: str | None = None
+    error: str
+
+class ImportReport(BaseModel):
+    # Resultado de una importación masiva de productos
+    processed: int  # Filas leídas (válidas o no)
+    upserted: int  # Filas insertadas o actualizadas
+    errors: list[ImportRowError]
+    elapsed_seconds: float
+    rows_per_second: float
+
 # ---------- Movimientos ----------
 class MovementCreate(BaseModel):
     # Datos necesarios para registrar un movimiento de stock
     product_id: int
     delta: int
     reason: str | None = None
+    # Clave de idempotencia de la línea en /api/movements/bulk (en POST /api/movements, cabecera Idempotency-Key)
+    idempotency_key: str | None = Field(None, min_length=1, max_length=255)
+
+class ScanCreate(BaseModel):
+    # Escaneo en un puesto de empaquetado: EAN13 o SKU del producto y cantidad
+    code: str = Field(min_length=1, max_length=64)
+    delta: int
+    reason: str | None = None
 
 class MovementOut(BaseModel):
     # Esquema de salida para un movimiento de stock
@@ -84,3 +107,67 @@ class StockAdjust(BaseModel):
     # Datos para ajustar el stock a una cantidad exacta
     quantity: int = Field(ge=0)  # No se permite valor negativo
     reason: str | None = None
+
+# ---------- Snapshots de stock ----------
+class StockAt(BaseModel):
+    # Stock de un producto en un instante dado
+    product_id: int
+    at: datetime
+    stock_qty: int
+
+class StockLevel(BaseModel):
+    # Nivel de stock de un producto al cierre de un día y entradas/salidas de ese día
+    product_id: int
+    sku: str
+    day: date
+    qty_close: int
+    qty_in: int
+    qty_out: int
+
+# ---------- Informes ----------
+class ProductMetrics(BaseModel):
+    # Métricas de un producto en un rango de fechas (ver reports.metrics_query)
+    product_id: int
+    sku: str
+    name: str
+    stock_qty: int
+    qty_in: int
+    qty_out: int
+    movements: int
+    opening_qty: int
+    closing_qty: int
+    consumption_per_day: float
+    turnover: float | None  # None si el stock medio es 0
+    days_of_cover: float | None  # None si no hay consumo
+
+    class Config:
+        from_attributes = True
+
+# ---------- Reservas ----------
+class ReservationCreate(BaseModel):
+    # Datos para reservar stock de un producto
+    product_id: int
+    qty: int = Field(gt=0)
+    ttl_seconds: int | None = Field(None, ge=1, le=7 * 86400)  # Por defecto RESERVATION_TTL
+    reference: str | None = Field(None, max_length=255)
+
+class ReservationOut(BaseModel):
+    # Esquema de salida de una reserva
+    id: int
+    product_id: int
+    qty: int
+    status: str
+    reference: str | None
+    movement_id: int | None = None
+    created_at: datetime
+    expires_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class Availability(BaseModel):
+    # Stock físico, reservado y disponible de un producto
+    product_id: int
+    stock_qty: int
+    reserved_qty: int
+    available: int
@@ -1,12 +1,23 @@
-"""Pequeño script de seed para crear tablas y datos de ejemplo en la base de datos."""
+"""
+Pequeño script de seed para crear tablas y datos de ejemplo en la base de datos.
+Con --products/--movements carga volúmenes grandes en lotes (benchmarks y pruebas de carga).
+"""
 
+import argparse
 import os
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, update
 from sqlalchemy.orm import Session
 
-from .database import Base, engine, SessionLocal
-from .models import Product, User
+from .database import SessionLocal, get_engine
+from .migrations import migrate
+from .models import Product, StockMovement, User
 from .auth import hash_password
 
+SEED_CHUNK = 10000  # Filas por INSERT multi-fila en seed_bulk
+
 def seed(db: Session):
     """Crea datos iniciales si no existen usuarios o productos"""
 
@@ -26,12 +37,60 @@ def seed(db: Session):
             db.add(Product(sku=sku, ean13=ean, name=name, stock_qty=qty))
     db.commit()  # Guardar los cambios en la base de datos
 
-def main():
-    """Crea las tablas y ejecuta el seed"""
-    Base.metadata.create_all(bind=engine)
+def seed_bulk(db: Session, products: int, movements: int, days: int = 30, prefix: str = "BENCH", rnd_seed: int = 42) -> list[int]:
+    """
+    Carga products productos y movements movimientos repartidos en los últimos days días, en lotes
+    de SEED_CHUNK filas con INSERT multi-fila (sin objetos ORM). qty_before/qty_after quedan encadenados
+    por producto y stock_qty termina igual al último qty_after. Devuelve los IDs de los productos creados.
+    Con la misma semilla los datos son los mismos (resultados reproducibles).
+    """
+    rnd = random.Random(rnd_seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+    for first in range(0, products, SEED_CHUNK):
+        db.execute(insert(Product), [
+            {"sku": f"{prefix}-{i:08d}", "ean13": f"2{i:012d}", "name": f"Producto {prefix} {i}",
+             "stock_qty": 1000, "created_at": start, "updated_at": start}
+            for i in range(first, min(first + SEED_CHUNK, products))
+        ])
+    db.commit()
+    ids = db.execute(select(Product.id).where(Product.sku.startswith(f"{prefix}-")).order_by(Product.id)).scalars().all()
+
+    stock = dict.fromkeys(ids, 1000)
+    step = days * 86400 / max(movements, 1)
+    rows = []
+    for n in range(movements):
+        pid = rnd.choice(ids)
+        delta = rnd.choice((-5, -3, -2, -1, 1, 2, 4, 10))
+        before = stock[pid]
+        stock[pid] = before + delta
+        rows.append({"product_id": pid, "delta": delta, "qty_before": before, "qty_after": before + delta,
+                     "type": "IN" if delta > 0 else "OUT", "created_at": start + timedelta(seconds=n * step)})
+        if len(rows) == SEED_CHUNK:
+            db.execute(insert(StockMovement), rows)
+            rows = []
+    if rows:
+        db.execute(insert(StockMovement), rows)
+    changed = [{"id": pid, "stock_qty": qty} for pid, qty in stock.items() if qty != 1000]
+    for first in range(0, len(changed), SEED_CHUNK):
+        db.execute(update(Product), changed[first:first + SEED_CHUNK])
+    db.commit()
+    return ids
+
+def main(argv: list[str] | None = None):
+    """Aplica las migraciones pendientes y ejecuta el seed (o la carga masiva con --products/--movements)"""
+    parser = argparse.ArgumentParser(prog="python -m app.seed", description="Datos de ejemplo o carga masiva")
+    parser.add_argument("--products", type=int, default=0, help="Productos a generar en bloque")
+    parser.add_argument("--movements", type=int, default=0, help="Movimientos a generar en bloque")
+    parser.add_argument("--days", type=int, default=30, help="Días que abarcan los movimientos generados")
+    args = parser.parse_args(argv)
+
+    migrate(get_engine())
     db = SessionLocal()
     try:
         seed(db)
+        if args.products:
+            seed_bulk(db, args.products, args.movements, args.days)
         print("Seed completado.")  # Confirmación por consola
     finally:
         db.close()  # Cierra la sesión para liberar recursos
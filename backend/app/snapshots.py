@@ -0,0 +1,405 @@
+"""
+Resúmenes diarios de stock por producto (stock_snapshots) y consultas de stock en una fecha.
+El rollup agrega en la base de datos los movimientos nuevos con GROUP BY (producto, día) y avanza
+una marca de agua (snapshot_state); las consultas leen el resumen y solo la cola de movimientos posterior,
+en lugar de recorrer todo el historial del producto.
+En la misma transacción mantiene movement_window, los totales por producto de los últimos REPORT_WINDOW_DAYS
+días con los que app.reports responde sin agregar todos los movimientos del rango.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import date, datetime, time as dtime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Date, Row, case, delete, func, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from .models import MovementArchive, MovementWindow, Product, SnapshotState, StockMovement, StockSnapshot
+from .schemas import StockLevel
+
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "60"))  # Segundos entre rollups en segundo plano (0 = desactivado)
+SNAPSHOT_LAG = float(os.getenv("SNAPSHOT_LAG", "5"))  # Antigüedad mínima de un movimiento para agregarlo
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "500000"))  # Rango de IDs de movimiento por transacción
+REPORT_WINDOW_DAYS = int(os.getenv("REPORT_WINDOW_DAYS", "30"))  # Días totalizados en movement_window (0 = sin ventana)
+
+logger = logging.getLogger(__name__)
+
+def naive_utc(value: datetime) -> datetime:
+    # Los movimientos se guardan en UTC sin zona horaria
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, dtime.min)
+
+# ------- Rollup -------
+def _lock_state(db: Session) -> Row:
+    """
+    Bloquea la fila de estado (UPDATE sin cambios, como crud.stock_lock_stmt) para que
+    un solo worker haga el rollup a la vez; la crea si no existe. Devuelve la marca de agua.
+    """
+    stmt = (
+        update(SnapshotState)
+        .where(SnapshotState.id == 1)
+        .values(last_movement_id=SnapshotState.last_movement_id)
+        .returning(SnapshotState.last_movement_id, SnapshotState.last_movement_at, SnapshotState.window_start)
+        .execution_options(synchronize_session=False)
+    )
+    row = db.execute(stmt).first()
+    if row is None:
+        try:
+            with db.begin_nested():
+                db.add(SnapshotState(id=1, last_movement_id=0))
+        except IntegrityError:
+            pass  # Otro worker la creó a la vez
+        row = db.execute(stmt).one()
+    return row
+
+def _rollup_upper_bound(db: Session, after_id: int, lag: float, batch_size: int) -> int | None:
+    """
+    Último ID a agregar en esta pasada: como mucho batch_size movimientos y nunca
+    movimientos más recientes que lag segundos (pueden quedar transacciones con IDs menores sin confirmar).
+    """
+    last_id = db.scalar(select(func.max(StockMovement.id)))
+    if last_id is None or last_id <= after_id:
+        return None
+    upper = min(last_id, after_id + batch_size)
+    if lag > 0:
+        cutoff = datetime.utcnow() - timedelta(seconds=lag)
+        recent = db.scalar(
+            select(func.min(StockMovement.id)).where(StockMovement.created_at >= cutoff, StockMovement.id > after_id)
+        )
+        if recent is not None:
+            upper = min(upper, recent - 1)
+    return upper if upper > after_id else None
+
+def _rollup_select(after_id: int, upper_id: int):
+    """Agrega los movimientos (after_id, upper_id] por producto y día; el cierre es el qty_after del último"""
+    day = func.date(StockMovement.created_at, type_=Date)
+    groups = (
+        select(
+            StockMovement.product_id,
+            day.label("day"),
+            func.sum(case((StockMovement.delta > 0, StockMovement.delta), else_=0)).label("qty_in"),
+            func.sum(case((StockMovement.delta < 0, -StockMovement.delta), else_=0)).label("qty_out"),
+            func.max(StockMovement.id).label("last_id"),
+        )
+        .where(StockMovement.id > after_id, StockMovement.id <= upper_id)
+        .group_by(StockMovement.product_id, day)
+        .subquery()
+    )
+    last = aliased(StockMovement)
+    return (
+        select(groups.c.product_id, groups.c.day, last.qty_after, groups.c.qty_in, groups.c.qty_out, groups.c.last_id)
+        .join(last, last.id == groups.c.last_id)
+        .where(groups.c.last_id > after_id)  # WHERE explícito: SQLite no admite JOIN ... ON seguido de ON CONFLICT
+    )
+
+def _merge_snapshots(db: Session, after_id: int, upper_id: int) -> None:
+    """
+    Inserta los resúmenes nuevos o los suma a los existentes (un día puede agregarse en varias pasadas).
+    PostgreSQL y SQLite lo hacen en una sola sentencia INSERT ... SELECT ... ON CONFLICT.
+    """
+    rows = _rollup_select(after_id, upper_id)
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        columns = ["product_id", "day", "qty_close", "qty_in", "qty_out", "last_movement_id"]
+        stmt = insert(StockSnapshot).from_select(columns, rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StockSnapshot.product_id, StockSnapshot.day],
+            set_={
+                "qty_close": stmt.excluded.qty_close,
+                "qty_in": StockSnapshot.qty_in + stmt.excluded.qty_in,
+                "qty_out": StockSnapshot.qty_out + stmt.excluded.qty_out,
+                "last_movement_id": stmt.excluded.last_movement_id,
+            },
+        )
+        db.execute(stmt)
+        return
+    # Otros motores: fusión fila a fila
+    for product_id, day, qty_close, qty_in, qty_out, last_id in db.execute(rows):
+        snap = db.get(StockSnapshot, (product_id, day))
+        if snap is None:
+            db.add(StockSnapshot(product_id=product_id, day=day, qty_close=qty_close,
+                                 qty_in=qty_in, qty_out=qty_out, last_movement_id=last_id))
+        else:
+            snap.qty_close, snap.last_movement_id = qty_close, last_id
+            snap.qty_in += qty_in
+            snap.qty_out += qty_out
+    db.flush()
+
+def window_totals(*where):
+    """Totales por producto de los movimientos que cumplen where, con las columnas de movement_window"""
+    return (
+        select(
+            StockMovement.product_id,
+            func.count().label("movements"),
+            func.sum(case((StockMovement.type == "IN", StockMovement.delta), else_=0)).label("qty_in"),
+            func.sum(case((StockMovement.type == "OUT", -StockMovement.delta), else_=0)).label("qty_out"),
+            func.sum(StockMovement.delta).label("net"),
+        )
+        .where(*where)
+        .group_by(StockMovement.product_id)
+    )
+
+def _merge_window(db: Session, sign: int, *where) -> None:
+    """Suma (sign=1) o resta (sign=-1) a movement_window los movimientos que cumplen where"""
+    totals = window_totals(*where).subquery()
+    columns = ["product_id", "movements", "qty_in", "qty_out", "net"]
+    rows = select(totals.c.product_id, *(totals.c[c] if sign > 0 else -totals.c[c] for c in columns[1:]))
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        # WHERE explícito, como en _rollup_select: evita la ambigüedad de SQLite con ON CONFLICT
+        stmt = insert(MovementWindow).from_select(columns, rows.where(totals.c.movements > 0))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MovementWindow.product_id],
+            set_={c: MovementWindow.__table__.c[c] + stmt.excluded[c] for c in columns[1:]},
+        )
+        db.execute(stmt)
+        return
+    for product_id, *values in db.execute(rows):
+        current = db.get(MovementWindow, product_id)
+        if current is None:
+            db.add(MovementWindow(product_id=product_id, **dict(zip(columns[1:], values))))
+        else:
+            for column, value in zip(columns[1:], values):
+                setattr(current, column, getattr(current, column) + value)
+    db.flush()
+
+def _advance_window(db: Session, state: Row, upper_id: int) -> datetime | None:
+    """
+    Lleva movement_window hasta upper_id y devuelve su nuevo inicio. Invariante: la tabla suma los movimientos
+    con ID <= marca de agua y created_at >= window_start. Al cambiar de día se restan los días que salen de la
+    ventana; la primera vez (o tras activarla) se calcula con todos los movimientos ya agregados.
+    """
+    if REPORT_WINDOW_DAYS <= 0:
+        if state.window_start is not None:
+            db.execute(delete(MovementWindow))
+        return None
+    after_id, start = state.last_movement_id, state.window_start
+    target = day_start(datetime.utcnow().date() - timedelta(days=REPORT_WINDOW_DAYS))
+    if start is None:
+        db.execute(delete(MovementWindow))
+        after_id, start = 0, target
+    elif start < target:
+        _merge_window(db, -1, StockMovement.id <= after_id, StockMovement.created_at >= start, StockMovement.created_at < target)
+        db.execute(delete(MovementWindow).where(MovementWindow.movements == 0))
+        start = target
+    _merge_window(db, 1, StockMovement.id > after_id, StockMovement.id <= upper_id, StockMovement.created_at >= start)
+    return start
+
+def discard_from_window(db: Session, start: datetime, end: datetime) -> None:
+    """Resta de movement_window los movimientos de [start, end) antes de borrarlos de la tabla (app.archive)"""
+    state = _lock_state(db)
+    if state.window_start is not None and end > state.window_start:
+        _merge_window(db, -1, StockMovement.id <= state.last_movement_id,
+                      StockMovement.created_at >= max(start, state.window_start), StockMovement.created_at < end)
+
+def rollup(db: Session, lag: float = SNAPSHOT_LAG, batch_size: int = SNAPSHOT_BATCH_SIZE) -> int:
+    """
+    Agrega en stock_snapshots y movement_window los movimientos posteriores a la marca de agua.
+    Cada pasada de batch_size IDs se confirma por separado; devuelve cuántos IDs se han procesado.
+    """
+    processed = 0
+    while True:
+        state = _lock_state(db)
+        upper_id = _rollup_upper_bound(db, state.last_movement_id, lag, batch_size)
+        if upper_id is None:
+            db.rollback()
+            return processed
+        _merge_snapshots(db, state.last_movement_id, upper_id)
+        window_start = _advance_window(db, state, upper_id)
+        last_at = db.scalar(
+            select(StockMovement.created_at).where(StockMovement.id <= upper_id).order_by(StockMovement.id.desc()).limit(1)
+        )
+        db.execute(
+            update(SnapshotState)
+            .where(SnapshotState.id == 1)
+            .values(last_movement_id=upper_id, last_movement_at=last_at or state.last_movement_at,
+                    window_start=window_start, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        processed += upper_id - state.last_movement_id
+        logger.info("Rollup de snapshots hasta el movimiento %d", upper_id)
+
+async def rollup_loop(session_factory, interval: float = SNAPSHOT_INTERVAL):
+    """Rollup periódico en segundo plano (tarea del lifespan de la aplicación)"""
+    def run_once():
+        with session_factory() as db:
+            rollup(db)
+
+    while True:
+        try:
+            await run_in_threadpool(run_once)
+        except Exception:
+            logger.exception("Error en el rollup de snapshots")
+        await asyncio.sleep(interval)
+
+# ------- Consultas -------
+def _watermark(db: Session) -> tuple[int, datetime | None]:
+    state = db.get(SnapshotState, 1)
+    return (state.last_movement_id, state.last_movement_at) if state else (0, None)
+
+class ArchivedPeriodError(Exception):
+    """Instante a mitad de un día archivado: sus movimientos ya no están en la tabla"""
+
+def _archived(db: Session, at: datetime) -> bool:
+    return db.scalar(
+        select(MovementArchive.id).where(MovementArchive.period_start <= at, MovementArchive.period_end > at).limit(1)
+    ) is not None
+
+def stock_at(db: Session, product_id: int, at: datetime) -> int | None:
+    """
+    Stock de un producto en el instante at (None si el producto no existe):
+    cierre del último snapshot anterior al día de at más la cola de movimientos posteriores al último
+    movimiento agregado en él (basta el qty_after del último; el rollup puede haber cortado a mitad del día).
+    Sin movimientos previos, el stock es la apertura del primer snapshot desde ese día (cierre - entradas + salidas),
+    el qty_before del primer movimiento posterior o, si no hay ninguno, el stock actual.
+    En un mes archivado (app.archive) solo quedan los snapshots: si el producto tuvo movimientos el día de at,
+    solo se puede responder al inicio del día y a mitad del día se lanza ArchivedPeriodError.
+    """
+    at = naive_utc(at)
+    if at > day_start(at.date()) and db.get(StockSnapshot, (product_id, at.date())) is not None and _archived(db, at):
+        raise ArchivedPeriodError(
+            f"Los movimientos del {at:%Y-%m-%d} están archivados: el stock de ese día solo se conoce al inicio de cada día"
+        )
+    snap = db.execute(
+        select(StockSnapshot.day, StockSnapshot.qty_close, StockSnapshot.last_movement_id)
+        .where(StockSnapshot.product_id == product_id, StockSnapshot.day < at.date())
+        .order_by(StockSnapshot.day.desc())
+        .limit(1)
+    ).first()
+    tail = select(StockMovement.qty_after).where(StockMovement.product_id == product_id, StockMovement.created_at < at)
+    if snap is not None:
+        tail = tail.where(StockMovement.created_at >= day_start(snap.day), StockMovement.id > snap.last_movement_id)
+    last = db.scalar(tail.order_by(StockMovement.created_at.desc(), StockMovement.id.desc()).limit(1))
+    if last is not None:
+        return last
+    if snap is not None:
+        return snap.qty_close
+    # Primer día con snapshot (agregado, aunque sus movimientos estén archivados)
+    opening = db.scalar(
+        select(StockSnapshot.qty_close - StockSnapshot.qty_in + StockSnapshot.qty_out)
+        .where(StockSnapshot.product_id == product_id, StockSnapshot.day >= at.date())
+        .order_by(StockSnapshot.day.asc())
+        .limit(1)
+    )
+    if opening is not None:
+        return opening
+    following = db.scalar(
+        select(StockMovement.qty_before)
+        .where(StockMovement.product_id == product_id, StockMovement.created_at >= at)
+        .order_by(StockMovement.created_at.asc(), StockMovement.id.asc())
+        .limit(1)
+    )
+    if following is not None:
+        return following
+    return db.scalar(select(Product.stock_qty).where(Product.id == product_id))
+
+def stock_levels(db: Session, day: date, limit: int = 500, after_id: int | None = None) -> list[StockLevel]:
+    """
+    Nivel de stock al cierre de day para una página de productos (por ID ascendente).
+    - Último snapshot de cada producto hasta day.
+    - Movimientos aún no agregados (posteriores a la marca de agua) hasta el final de day.
+    - Productos sin movimientos hasta day: apertura del primer snapshot posterior, qty_before del primer
+      movimiento posterior o stock actual.
+    """
+    end = day_start(day + timedelta(days=1))
+    q = select(Product.id, Product.sku, Product.stock_qty).where(Product.created_at < end).order_by(Product.id).limit(limit)
+    if after_id is not None:
+        q = q.where(Product.id > after_id)
+    products = db.execute(q).all()
+    if not products:
+        return []
+    ids = [p.id for p in products]
+
+    latest = (
+        select(StockSnapshot.product_id, func.max(StockSnapshot.day).label("day"))
+        .where(StockSnapshot.product_id.in_(ids), StockSnapshot.day <= day)
+        .group_by(StockSnapshot.product_id)
+        .subquery()
+    )
+    snaps = {
+        s.product_id: s
+        for s in db.execute(
+            select(StockSnapshot).join(
+                latest, tuple_(StockSnapshot.product_id, StockSnapshot.day) == tuple_(latest.c.product_id, latest.c.day)
+            )
+        ).scalars()
+    }
+
+    # Cola no agregada: desde el último movimiento agregado hasta el final del día
+    wm_id, wm_at = _watermark(db)
+    since = day_start(day)
+    tail_q = select(
+        StockMovement.product_id,
+        func.max(StockMovement.id).label("last_id"),
+        func.sum(case((StockMovement.created_at >= since, case((StockMovement.delta > 0, StockMovement.delta), else_=0)), else_=0)).label("qty_in"),
+        func.sum(case((StockMovement.created_at >= since, case((StockMovement.delta < 0, -StockMovement.delta), else_=0)), else_=0)).label("qty_out"),
+    ).where(StockMovement.product_id.in_(ids), StockMovement.id > wm_id, StockMovement.created_at < end)
+    if wm_at is not None:
+        tail_q = tail_q.where(StockMovement.created_at >= wm_at)
+    tail_q = tail_q.group_by(StockMovement.product_id).subquery()
+    tails = {
+        t.product_id: t
+        for t in db.execute(
+            select(tail_q.c.product_id, tail_q.c.qty_in, tail_q.c.qty_out, StockMovement.qty_after)
+            .join(StockMovement, StockMovement.id == tail_q.c.last_id)
+        )
+    }
+
+    # Productos sin ningún movimiento hasta day
+    pending = [i for i in ids if i not in snaps and i not in tails]
+    following = {}
+    if pending:
+        first = (
+            select(StockMovement.product_id, func.min(StockMovement.id).label("first_id"))
+            .where(StockMovement.product_id.in_(pending), StockMovement.created_at >= end)
+            .group_by(StockMovement.product_id)
+            .subquery()
+        )
+        following = dict(db.execute(
+            select(first.c.product_id, StockMovement.qty_before).join(StockMovement, StockMovement.id == first.c.first_id)
+        ).all())
+        # Apertura del primer día agregado después de day (sus movimientos pueden estar ya archivados)
+        next_day = (
+            select(StockSnapshot.product_id, func.min(StockSnapshot.day).label("day"))
+            .where(StockSnapshot.product_id.in_(pending), StockSnapshot.day > day)
+            .group_by(StockSnapshot.product_id)
+            .subquery()
+        )
+        following.update(db.execute(
+            select(StockSnapshot.product_id, StockSnapshot.qty_close - StockSnapshot.qty_in + StockSnapshot.qty_out).join(
+                next_day, tuple_(StockSnapshot.product_id, StockSnapshot.day) == tuple_(next_day.c.product_id, next_day.c.day)
+            )
+        ).all())
+
+    levels = []
+    for p in products:
+        snap, tail = snaps.get(p.id), tails.get(p.id)
+        qty_in = qty_out = 0
+        if snap is not None and snap.day == day:
+            qty_in, qty_out = snap.qty_in, snap.qty_out
+        if tail is not None:
+            close = tail.qty_after
+            qty_in += tail.qty_in
+            qty_out += tail.qty_out
+        elif snap is not None:
+            close = snap.qty_close
+        else:
+            close = following.get(p.id, p.stock_qty)
+        levels.append(StockLevel(product_id=p.id, sku=p.sku, day=day, qty_close=close, qty_in=qty_in, qty_out=qty_out))
+    return levels
@@ -0,0 +1,4 @@
+"""
+Benchmarks del backend de inventario.
+Se ejecutan desde la carpeta backend, por ejemplo: python -m bench.bulk_movements
+"""
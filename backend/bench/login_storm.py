@@ -0,0 +1,116 @@
+"""
+Benchmark: ráfaga de logins con bcrypt en el propio event loop (PASSWORD_HASH_WORKERS=0)
+frente al pool dedicado y acotado de hashing.py.
+Mientras dura la ráfaga se mide la latencia de GET /api/products y GET /health,
+que no deberían verse afectadas cuando el hashing está fuera del event loop.
+
+Uso:
+    python -m bench.login_storm --logins 400 --concurrency 64
+    python -m bench.login_storm --workers 8 --queue 32 --rounds 12
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from passlib.context import CryptContext
+from sqlalchemy.orm import Session
+
+from app.database import Base, make_engine
+from app.models import Product, User
+from bench.async_load import free_port, start_server, summarize
+
+EMAIL = "storm@example.com"
+PASSWORD = "secreto1"
+
+def prepare(url: str, rounds: int):
+    """Crea las tablas desde cero con un usuario y algunos productos"""
+    engine = make_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        password_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds).hash(PASSWORD)
+        db.add(User(email=EMAIL, password_hash=password_hash))
+        db.add_all(
+            Product(sku=f"STORM-{i:04d}", ean13=f"{i:013d}", name=f"Storm {i}", stock_qty=10)
+            for i in range(1, 101)
+        )
+        db.commit()
+    engine.dispose()
+
+async def storm(base: str, logins: int, concurrency: int) -> dict:
+    """Lanza `logins` logins con `concurrency` clientes y sondea otros endpoints mientras tanto"""
+    login_ok: list[float] = []
+    rejected = 0
+    others: dict[str, list[float]] = {"GET /api/products": [], "GET /health": []}
+    done = asyncio.Event()
+    remaining = iter(range(logins))
+
+    async def login_loop(client: httpx.AsyncClient):
+        nonlocal rejected
+        for _ in remaining:
+            start = time.perf_counter()
+            r = await client.post("/auth/login", data={"username": EMAIL, "password": PASSWORD})
+            if r.status_code == 429:
+                rejected += 1
+                continue
+            r.raise_for_status()
+            login_ok.append(time.perf_counter() - start)
+
+    async def probe_loop(client: httpx.AsyncClient):
+        while not done.is_set():
+            for name, path in (("GET /api/products", "/api/products?limit=20"), ("GET /health", "/health")):
+                start = time.perf_counter()
+                (await client.get(path)).raise_for_status()
+                others[name].append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    limits = httpx.Limits(max_connections=concurrency + 4)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120) as client:
+        probes = [asyncio.create_task(probe_loop(client)) for _ in range(2)]
+        start = time.perf_counter()
+        await asyncio.gather(*(login_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await asyncio.gather(*probes)
+    return {"elapsed": elapsed, "logins": login_ok, "rejected": rejected, "others": others}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="URL de base de datos (por defecto SQLite temporal)")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--queue", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=12, help="BCRYPT_ROUNDS")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    url = args.url or f"sqlite:///{os.path.join(tmpdir.name, 'storm.db')}"
+
+    modes = {
+        "event loop": {"PASSWORD_HASH_WORKERS": "0"},
+        f"pool ({args.workers} workers, cola {args.queue})": {
+            "PASSWORD_HASH_WORKERS": str(args.workers), "PASSWORD_HASH_QUEUE": str(args.queue),
+        },
+    }
+    for name, env in modes.items():
+        prepare(url, args.rounds)
+        port = free_port()
+        proc = start_server(url, False, port, {**env, "BCRYPT_ROUNDS": str(args.rounds)})
+        try:
+            result = asyncio.run(storm(f"http://127.0.0.1:{port}", args.logins, args.concurrency))
+        finally:
+            proc.terminate()
+            proc.wait()
+        elapsed = result["elapsed"]
+        print(f"[{name}] logins: {summarize(result['logins'], elapsed)} rechazados (429): {result['rejected']}")
+        for endpoint, values in result["others"].items():
+            print(f"[{name}]   {endpoint} durante la ráfaga: {summarize(values, elapsed)}")
+    tmpdir.cleanup()
+
+if __name__ == "__main__":
+    main()
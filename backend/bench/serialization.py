@@ -0,0 +1,90 @@
+"""
+Microbenchmark: serialización de GET /api/products y GET /api/movements con 10k filas por página.
+Compara la ruta normal (entidades ORM / filas validadas con ProductOut y MovementOut) con FAST_SERIALIZATION
+(filas de la consulta codificadas con orjson). Mide CPU por página (consulta + construcción + JSON) con
+time.process_time y el pico de memoria con tracemalloc, y comprueba que el JSON es idéntico.
+
+Uso:
+    python -m bench.serialization --rows 10000 --repeat 20
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, deps
+from app.database import Base, make_engine
+from app.models import Product, StockMovement
+
+def prepare(url: str, rows: int):
+    """Crea las tablas desde cero con rows productos y rows movimientos"""
+    engine = make_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    now = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    with engine.begin() as conn:
+        conn.execute(insert(Product), [
+            {"sku": f"SER-{i:06d}", "ean13": f"{i:013d}", "name": f"Producto número {i}", "stock_qty": i,
+             "created_at": now, "updated_at": now}
+            for i in range(1, rows + 1)
+        ])
+        conn.execute(insert(StockMovement), [
+            {"product_id": i % rows + 1, "delta": 1, "qty_before": i, "qty_after": i + 1, "reason": "Recepción",
+             "type": "IN", "created_at": now + timedelta(seconds=i)}
+            for i in range(rows)
+        ])
+    return engine, sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+def page(Session, endpoint: str, rows: int, fast: bool) -> bytes:
+    # Lo que hace la ruta: consulta del listado y cuerpo JSON de la página
+    deps.FAST_SERIALIZATION = fast
+    with Session() as db:
+        if endpoint == "products":
+            params = deps.ProductListParams(rows, None, None, None, None, None, crud.PRODUCT_FIELDS)
+            return deps.products_page(crud.list_products(db, **params.filters()), params)[0]
+        params = deps.MovementListParams(None, rows, None, None, None, None)
+        return deps.movements_page(crud.list_movements(db, rows=fast, **params.filters()), params)[0]
+
+def measure(Session, endpoint: str, rows: int, fast: bool, repeat: int) -> dict:
+    page(Session, endpoint, rows, fast)  # Calentamiento
+    start = time.process_time()
+    for _ in range(repeat):
+        body = page(Session, endpoint, rows, fast)
+    cpu_ms = (time.process_time() - start) / repeat * 1000
+    tracemalloc.start()
+    page(Session, endpoint, rows, fast)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"cpu_ms": round(cpu_ms, 1), "peak_mib": round(peak / 2**20, 2), "body": body}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="URL de base de datos (por defecto SQLite temporal)")
+    parser.add_argument("--rows", type=int, default=10000, help="Filas por página")
+    parser.add_argument("--repeat", type=int, default=20, help="Páginas por medición")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    url = args.url or f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+    engine, Session = prepare(url, args.rows)
+
+    print(f"{args.rows} filas por página, {args.repeat} repeticiones ({engine.dialect.name}, orjson: {deps.orjson is not None})")
+    for endpoint in ("products", "movements"):
+        normal = measure(Session, endpoint, args.rows, False, args.repeat)
+        fast = measure(Session, endpoint, args.rows, True, args.repeat)
+        assert normal["body"] == fast["body"], f"JSON distinto en {endpoint}"
+        print(f"  GET /api/{endpoint}")
+        for label, r in (("normal", normal), ("FAST_SERIALIZATION", fast)):
+            print(f"    {label:20s} CPU {r['cpu_ms']:>8.1f} ms/página  pico de memoria {r['peak_mib']:>6.2f} MiB")
+        print(f"    mejora CPU: x{normal['cpu_ms'] / fast['cpu_ms']:.1f}")
+    engine.dispose()
+    tmpdir.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Pruebas de las rutas asíncronas (modo DB_ASYNC) sobre un fichero SQLite con aiosqlite.
+Se montan en una app aparte para no depender de la configuración con la que se importó app.main.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.async_api import router
+from app.database import Base, get_async_db, make_async_engine
+
+@pytest.fixture()
+def client(tmp_path):
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    Base.metadata.create_all(bind=create_engine(url))
+    async_engine = make_async_engine(url)
+    SessionAsync = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with SessionAsync() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    with TestClient(app) as c:  # Un único event loop para todas las peticiones
+        yield c
+
+def test_async_inventory_flow(client):
+    r = client.post("/api/products", json={"sku":"SKU-ASYNC","ean13":"1234567811111","name":"Async","stock_qty":10})
+    assert r.status_code == 200, r.text
+    pid = r.json()["id"]
+
+    r = client.post("/api/movements", json={"product_id": pid, "delta": 5})
+    assert r.status_code == 200, r.text
+    assert (r.json()["qty_before"], r.json()["qty_after"]) == (10, 15)
+
+    r = client.patch(f"/api/products/{pid}/stock", json={"quantity": 7, "reason": "Inventario"})
+    assert r.status_code == 200
+    assert r.json()["delta"] == -8
+
+    r = client.post("/api/movements/bulk", json=[{"product_id": pid, "delta": 1}, {"product_id": pid, "delta": 2}])
+    assert [m["qty_after"] for m in r.json()] == [8, 10]
+    assert client.post("/api/movements", json={"product_id": 999, "delta": 1}).status_code == 404
+
+    r = client.get(f"/api/movements?product_id={pid}&limit=3")
+    assert len(r.json()) == 3
+    assert "X-Next-Cursor" in r.headers
+
+    r = client.get("/api/products?fields=sku,stock_qty")
+    assert r.json() == [{"id": pid, "sku": "SKU-ASYNC", "stock_qty": 10}]
@@ -0,0 +1,125 @@
+"""
+Prueba de estrés multi-hilo de record_movement / set_stock sobre un mismo producto.
+Usa un fichero SQLite temporal (o TEST_DATABASE_URL si se define, p. ej. PostgreSQL).
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import threading
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Product, StockMovement
+from app.crud import InsufficientStock, get_product, record_movement, set_stock
+
+THREADS = 8
+OPS_PER_THREAD = 40
+
+@pytest.fixture()
+def session_factory(tmp_path):
+    url = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{tmp_path / 'stress.db'}"
+    connect_args = {"check_same_thread": False, "timeout": 30} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args, pool_size=THREADS)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+
+def test_concurrent_movements_keep_stock_consistent(session_factory):
+    with session_factory() as db:
+        p = Product(sku="SKU-HOT", ean13="1234567812345", name="Hot", stock_qty=100)
+        db.add(p)
+        db.commit()
+        pid = p.id
+
+    errors = []
+    rejected = []
+
+    def worker(seed: int):
+        rnd = random.Random(seed)
+        try:
+            with session_factory() as db:
+                for _ in range(OPS_PER_THREAD):
+                    product = get_product(db, pid)
+                    if rnd.random() < 0.1:
+                        set_stock(db, product, quantity=rnd.randint(0, 200), reason="stress")
+                    else:
+                        delta = rnd.choice([-3, -1, 1, 2, 5])
+                        try:
+                            record_movement(db, product, delta=delta, reason="stress", mtype="IN" if delta >= 0 else "OUT")
+                        except InsufficientStock:
+                            rejected.append(delta)  # Salida sin stock suficiente: no se aplica
+        except Exception as e:  # pragma: no cover - se reporta abajo
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+
+    with session_factory() as db:
+        stock = db.execute(select(Product.stock_qty).where(Product.id == pid)).scalar_one()
+        total = db.execute(select(func.sum(StockMovement.delta)).where(StockMovement.product_id == pid)).scalar_one()
+        history = db.execute(
+            select(StockMovement.qty_before, StockMovement.qty_after)
+            .where(StockMovement.product_id == pid)
+            .order_by(StockMovement.id)
+        ).all()
+
+    assert len(history) == THREADS * OPS_PER_THREAD - len(rejected)
+    assert stock == 100 + total
+    assert all(after >= 0 for _, after in history)
+    # El historial encadena: cada movimiento parte del stock que dejó el anterior
+    expected_before = 100
+    for before, after in history:
+        assert before == expected_before
+        expected_before = after
+    assert expected_before == stock
+
+def test_concurrent_reservations_never_oversell(session_factory):
+    from app.models import Reservation
+    from app.reservations import InsufficientStock, reserve
+
+    with session_factory() as db:
+        p = Product(sku="SKU-RES", ean13="1234567812346", name="Hot", stock_qty=100)
+        db.add(p)
+        db.commit()
+        pid = p.id
+
+    granted, rejected, errors = [], [], []
+
+    def worker(seed: int):
+        rnd = random.Random(seed)
+        try:
+            with session_factory() as db:
+                for _ in range(OPS_PER_THREAD):
+                    qty = rnd.choice([1, 2, 3])
+                    try:
+                        granted.append(reserve(db, pid, qty)["qty"])
+                    except InsufficientStock:
+                        rejected.append(qty)
+        except Exception as e:  # pragma: no cover - se reporta abajo
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+
+    with session_factory() as db:
+        reserved = db.execute(select(Product.reserved_qty).where(Product.id == pid)).scalar_one()
+        active = db.execute(select(func.sum(Reservation.qty)).where(Reservation.product_id == pid)).scalar_one()
+    # Nunca se reserva más que el stock y el contador coincide con las reservas creadas
+    assert reserved == active == sum(granted) <= 100
+    assert rejected and 100 - reserved < max(rejected)
@@ -0,0 +1,92 @@
+"""
+Particionado mensual de stock_movements y archivado sobre PostgreSQL real.
+Solo se ejecuta si TEST_DATABASE_URL apunta a PostgreSQL (la base de datos se vacía al empezar y al terminar).
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, func, inspect, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app import archive
+from app.database import Base
+from app.migrations import migrate, schema_version
+from app.models import Product, StockMovement
+from app.partitions import DEFAULT_PARTITION, convert_to_partitioned, is_partitioned, partition_name
+from app.snapshots import rollup, stock_at
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+
+pytestmark = pytest.mark.skipif(
+    not TEST_DATABASE_URL.startswith("postgresql"), reason="TEST_DATABASE_URL no apunta a PostgreSQL"
+)
+
+def reset(engine):
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS movement_refs"))
+    Base.metadata.drop_all(bind=engine)
+    schema_version.drop(engine, checkfirst=True)
+
+@pytest.fixture()
+def engine():
+    engine = create_engine(TEST_DATABASE_URL)
+    reset(engine)
+    migrate(engine)
+    yield engine
+    reset(engine)
+    engine.dispose()
+
+def test_convert_to_partitioned_and_archive(engine, tmp_path):
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    with Session() as db:
+        p = Product(sku="PART-1", ean13="5550000000044", name="Particionado", stock_qty=0, created_at=datetime(2022, 12, 1))
+        db.add(p)
+        db.flush()
+        qty = 0
+        for created_at, delta in ((datetime(2023, 1, 3), 10), (datetime(2023, 1, 10, 12), -4), (datetime(2023, 2, 5), 2)):
+            db.add(StockMovement(product_id=p.id, delta=delta, qty_before=qty, qty_after=qty + delta,
+                                 type="IN" if delta > 0 else "OUT", created_at=created_at))
+            qty += delta
+        p.stock_qty = qty
+        db.commit()
+        pid = p.id
+    with engine.begin() as conn:
+        # Tabla externa con clave foránea hacia stock_movements(id)
+        conn.execute(text("CREATE TABLE movement_refs (movement_id INTEGER REFERENCES stock_movements (id))"))
+
+    assert convert_to_partitioned(engine, months_ahead=1) is True
+    assert convert_to_partitioned(engine) is False  # Ya particionada
+    with engine.connect() as conn:
+        assert is_partitioned(conn)
+        tables = set(inspect(conn).get_table_names())
+        assert {partition_name(date(2023, 1, 1)), partition_name(date(2023, 2, 1)), DEFAULT_PARTITION} <= tables
+        assert inspect(conn).get_pk_constraint("stock_movements")["name"] == "stock_movements_pkey"
+        # Filas copiadas a su partición
+        assert conn.execute(text(f"SELECT count(*) FROM {partition_name(date(2023, 1, 1))}")).scalar() == 2
+        # Las claves foráneas hacia stock_movements se eliminan (no pueden referenciar solo id)
+        assert inspect(conn).get_foreign_keys("movement_refs") == []
+
+    with Session() as db:
+        # La secuencia de id sigue funcionando; una fecha sin partición mensual va a la DEFAULT
+        db.add(StockMovement(product_id=pid, delta=1, qty_before=qty, qty_after=qty + 1, type="IN",
+                             created_at=datetime(2040, 1, 1)))
+        db.commit()
+        assert db.scalar(select(func.count()).select_from(StockMovement)) == 4
+        assert db.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar() == 1
+
+        rollup(db, lag=0)
+        assert archive.archive_month(db, date(2023, 1, 1), str(tmp_path)) is not None
+    with engine.connect() as conn:
+        assert partition_name(date(2023, 1, 1)) not in inspect(conn).get_table_names()
+
+    with Session() as db:
+        assert db.scalar(select(func.count()).select_from(StockMovement)) == 2
+        # Stock histórico del mes archivado desde los snapshots
+        assert stock_at(db, pid, datetime(2023, 1, 10)) == 10
+        assert stock_at(db, pid, datetime(2023, 1, 11)) == 6
+        assert stock_at(db, pid, datetime(2023, 1, 2, 12)) == 0
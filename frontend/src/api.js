@@ -13,6 +13,27 @@ export async function apiGet(path) {
   return res.json()
 }
 
+// GET paginado: devuelve los datos y el cursor de la página siguiente (cabecera X-Next-Cursor)
+export async function apiGetPage(path) {
+  const res = await fetch(`${API_URL}${path}`, { headers: { ...authHeaders() } })
+  if (!res.ok) throw new Error(await res.text())
+  return { data: await res.json(), nextCursor: res.headers.get("X-Next-Cursor") }
+}
+
+// Suscripción en tiempo real a los movimientos confirmados (Server-Sent Events).
+// EventSource no admite cabeceras, así que el token va en ?token=. Devuelve la función para cerrarla.
+export function subscribeMovements(onMovement, { productIds = [], onDropped } = {}) {
+  const query = new URLSearchParams()
+  productIds.forEach(id => query.append("product_id", String(id)))
+  const token = localStorage.getItem("token")
+  if (token) query.set("token", token)
+  const source = new EventSource(`${API_URL}/api/events/movements?${query.toString()}`)
+  source.addEventListener("movement", e => onMovement(JSON.parse(e.data)))
+  // El servidor descartó eventos (cliente lento): hay que recargar
+  if (onDropped) source.addEventListener("dropped", () => onDropped())
+  return () => source.close()
+}
+
 export async function apiPost(path, body) {
   const res = await fetch(`${API_URL}${path}`, {
     method: "POST",
@@ -1,19 +1,27 @@
-// Componente React que muestra el inventario y permite ajustes de stock y movimientos manuales.
+// Componente React que muestra el inventario (paginado) y permite ajustes de stock y movimientos manuales.
 
 import React, { useEffect, useState } from "react"
-import { apiGet, apiPatch, apiPost } from "../api"
+import { apiGetPage, apiPatch, apiPost, subscribeMovements } from "../api"
+
+// Solo se piden las columnas que muestra la tabla
+const FIELDS = "id,sku,ean13,name,stock_qty"
+const PAGE_SIZE = 200
 
 export default function InventoryTable({ onChanged }) {
   const [items, setItems] = useState([]) // Lista de productos
   const [loading, setLoading] = useState(true) // Estado de carga
   const [error, setError] = useState("") // Mensaje de error
+  const [nextCursor, setNextCursor] = useState(null) // Cursor de la página siguiente
 
-  // Función para cargar los productos desde la API
-  const load = async () => {
+  // Función para cargar productos desde la API (cursor: añadir la página siguiente)
+  const load = async (cursor = null) => {
     try {
       setLoading(true)
-      const data = await apiGet("/api/products") // Llamada GET a /api/products
-      setItems(data) // Guardar productos en estado
+      const query = new URLSearchParams({ fields: FIELDS, limit: String(PAGE_SIZE) })
+      if (cursor) query.set("cursor", cursor)
+      const { data, nextCursor } = await apiGetPage(`/api/products?${query.toString()}`) // Llamada GET a /api/products
+      setItems(prev => cursor ? [...prev, ...data] : data) // Guardar productos en estado
+      setNextCursor(nextCursor)
     } catch (e) {
       setError(e.message) // Captura de error
     } finally {
@@ -21,9 +29,17 @@ export default function InventoryTable({ onChanged }) {
     }
   }
 
+  // Actualiza el stock de una fila con el resultado del movimiento, sin recargar el listado
+  const applyMovement = (m) => {
+    setItems(prev => prev.map(it => it.id === m.product_id ? { ...it, stock_qty: m.qty_after } : it))
+  }
+
   // Cargar productos al montar el componente
   useEffect(() => { load() }, [])
 
+  // Movimientos de otros usuarios en tiempo real; si se pierden eventos se recarga el listado
+  useEffect(() => subscribeMovements(applyMovement, { onDropped: () => load() }), [])
+
   // Función para ajustar manualmente el stock de un producto
   const adjust = async (id, current) => {
     const qtyStr = prompt(`Nueva cantidad para ID ${id} (actual ${current}):`, String(current))
@@ -31,8 +47,8 @@ export default function InventoryTable({ onChanged }) {
     const quantity = parseInt(qtyStr, 10)
     if (Number.isNaN(quantity) || quantity < 0) return alert("Cantidad inválida")
     try {
-      await apiPatch(`/api/products/${id}/stock`, { quantity, reason: "Ajuste manual" }) // PATCH a /api/products/:id/stock
-      await load() // Recargar productos
+      const m = await apiPatch(`/api/products/${id}/stock`, { quantity, reason: "Ajuste manual" }) // PATCH a /api/products/:id/stock
+      applyMovement(m)
       onChanged?.() // Notificar cambio al padre
     } catch (e) {
       alert("Error: " + e.message)
@@ -46,15 +62,15 @@ export default function InventoryTable({ onChanged }) {
     const delta = parseInt(deltaStr, 10)
     if (Number.isNaN(delta)) return alert("Delta inválido")
     try {
-      await apiPost(`/api/movements`, { product_id: id, delta, reason: "Movimiento manual" }) // POST a /api/movements
-      await load() // Recargar productos
+      const m = await apiPost(`/api/movements`, { product_id: id, delta, reason: "Movimiento manual" }) // POST a /api/movements
+      applyMovement(m)
       onChanged?.()
     } catch (e) {
       alert("Error: " + e.message)
     }
   }
 
-  if (loading) return <div>Cargando inventario...</div> // Mensaje de carga
+  if (loading && items.length === 0) return <div>Cargando inventario...</div> // Mensaje de carga
   if (error) return <div style={{color:"crimson"}}>Error: {error}</div> // Mostrar error
 
   // Renderizado de la tabla de inventario
@@ -88,6 +104,9 @@ export default function InventoryTable({ onChanged }) {
           ))}
         </tbody>
       </table>
+      {nextCursor && (
+        <button onClick={() => load(nextCursor)} disabled={loading} style={{marginTop:8}}>Cargar más</button>
+      )}
     </div>
   )
 }
@@ -1,27 +1,37 @@
 /**
  * Componente React para mostrar y filtrar el historial de movimientos de inventario.
- * Permite filtrar por ID de producto, establecer un límite de resultados y refrescar manualmente.
+ * Permite filtrar por ID de producto y tipo, establecer el tamaño de página, refrescar y cargar más resultados.
+ * Los movimientos nuevos llegan en tiempo real y se añaden al principio de la lista.
  */
 
-import React, { useEffect, useState } from "react"
-import { apiGet } from "../api"
+import React, { useEffect, useRef, useState } from "react"
+import { apiGetPage, subscribeMovements } from "../api"
 
 export default function Movements() {
   const [items, setItems] = useState([])      // Lista de movimientos cargados desde la API
   const [productId, setProductId] = useState("") // Filtro por product_id
+  const [type, setType] = useState("")        // Filtro por tipo (IN / OUT / ADJUST)
+  const [nextCursor, setNextCursor] = useState(null) // Cursor de la página siguiente
   const [limit, setLimit] = useState(50)      // Número máximo de registros a mostrar
   const [loading, setLoading] = useState(true) // Estado de carga
   const [error, setError] = useState("")       // Estado de error en la carga
+  const applied = useRef({ productId: "", type: "" }) // Filtros de la última carga (para los eventos en vivo)
+  const loadRef = useRef(null)
 
-  // Función para cargar movimientos desde la API
-  const load = async () => {
+  // Función para cargar movimientos desde la API (cursor: continuar tras la última página cargada)
+  const load = async (cursor = null) => {
     try {
       setLoading(true)
+      setError("")
       const query = new URLSearchParams()
       if (productId) query.set("product_id", productId)
+      if (type) query.set("type", type)
       if (limit) query.set("limit", String(limit))
-      const data = await apiGet(`/api/movements?${query.toString()}`)
-      setItems(data)
+      if (cursor) query.set("cursor", cursor)
+      else applied.current = { productId, type }
+      const { data, nextCursor } = await apiGetPage(`/api/movements?${query.toString()}`)
+      setItems(prev => cursor ? [...prev, ...data] : data)
+      setNextCursor(nextCursor)
     } catch (e) {
       setError(e.message)  // Guardar mensaje de error
     } finally {
@@ -29,9 +39,19 @@ export default function Movements() {
     }
   }
 
+  loadRef.current = load
+
   // Cargar datos al montar el componente
   useEffect(() => { load() }, [])
 
+  // Añadir al principio los movimientos nuevos que cumplan los filtros aplicados
+  useEffect(() => subscribeMovements(m => {
+    const f = applied.current
+    if (f.productId && String(m.product_id) !== f.productId) return
+    if (f.type && m.type !== f.type) return
+    setItems(prev => prev.some(it => it.id === m.id) ? prev : [m, ...prev])
+  }, { onDropped: () => loadRef.current() }), [])
+
   return (
     <div style={{marginTop:24}}>
       <h3>Historial de movimientos</h3>
@@ -39,8 +59,14 @@ export default function Movements() {
       {/* Filtros y controles */}
       <div style={{display:"flex", gap:8, marginBottom:8}}>
         <input placeholder="Filtrar por product_id" value={productId} onChange={e => setProductId(e.target.value)} />
+        <select value={type} onChange={e => setType(e.target.value)}>
+          <option value="">Todos los tipos</option>
+          <option value="IN">IN</option>
+          <option value="OUT">OUT</option>
+          <option value="ADJUST">ADJUST</option>
+        </select>
         <input placeholder="Límite" type="number" value={limit} onChange={e => setLimit(parseInt(e.target.value||"0",10))} />
-        <button onClick={load}>Refrescar</button>
+        <button onClick={() => load()}>Refrescar</button>
       </div>
 
       {/* Estados: cargando, error o tabla de resultados */}
@@ -76,6 +102,9 @@ export default function Movements() {
           </tbody>
         </table>
       )}
+      {!loading && !error && nextCursor && (
+        <button onClick={() => load(nextCursor)} style={{marginTop:8}}>Cargar más</button>
+      )}
     </div>
   )
 }